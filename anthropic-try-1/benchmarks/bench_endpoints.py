@@ -0,0 +1,368 @@
+"""Load test the MCP servers' endpoints with seeded data and a mixed workload
+
+Usage:
+    python benchmarks/bench_endpoints.py [--server file|function|simple] [--scale small|medium|large]
+        [--messages N] [--files N] [--concurrency N] [--requests N] [--seed N]
+        [--url http://localhost:5000] [--output results.json] [--compare baseline.json]
+
+By default the server module is imported and driven in-process through
+Flask's test client from a temporary working directory, so the run needs
+no network and never touches ./resources. Conversations and messages are seeded
+straight into storage and resource files straight onto disk before the
+search index is built. With --url the same workload is sent to a running
+server instead; seeding then goes through the API, so keep the scale small.
+
+The workload picks operations by weight from SERVER_OPERATIONS on
+--concurrency threads until --requests requests have been sent, and prints
+throughput, p50/p95/p99 latency per operation and peak RSS as JSON.
+--compare prints the change of each figure against an earlier --output.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import importlib.util
+import itertools
+import json
+import logging
+import os
+import platform
+import random
+import string
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+
+SERVER_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, SERVER_DIRECTORY)
+
+SERVER_MODULES = {
+    "file": "mcp-file-server.py",
+    "function": "mcp-function-server.py",
+    "simple": "simple_mcp_server.py",
+}
+
+# Seeded data per scale: (messages, resource files)
+SCALES = {
+    "small": (1000, 100),
+    "medium": (100000, 10000),
+    "large": (1000000, 100000),
+}
+
+# Operation -> relative weight in the mixed workload
+SERVER_OPERATIONS = {
+    "file": {"create_message": 3, "list_messages": 2, "read_file": 3, "search_files": 2, "create_completion": 1},
+    "function": {"create_message": 3, "list_messages": 2, "calculate": 3, "create_completion": 1},
+    "simple": {"create_message": 3, "list_messages": 2, "create_completion": 1},
+}
+
+MESSAGES_PER_CONVERSATION = 100
+WORDS_PER_FILE = 60
+VOCABULARY_SIZE = 5000
+
+
+# Clients
+
+class InProcessClient:
+    """Sends requests through Flask's test client, one client per thread"""
+
+    def __init__(self, app):
+        self.app = app
+        self._local = threading.local()
+
+    def request(self, method, path, body=None):
+        client = getattr(self._local, "client", None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        response = client.open(path, method=method, json=body)
+        return response.status_code, response.get_data()
+
+
+class HTTPClient:
+    """Sends requests to a running server"""
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip("/")
+
+    def request(self, method, path, body=None):
+        data = json.dumps(body).encode("utf-8") if body is not None else None
+        request = urllib.request.Request(self.base_url + path, data=data, method=method,
+                                         headers={"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(request) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+
+def load_server(server):
+    """Import a server module from the current directory's point of view"""
+    path = os.path.join(SERVER_DIRECTORY, SERVER_MODULES[server])
+    spec = importlib.util.spec_from_file_location(f"bench_{server}_server", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    if server == "file":
+        module.register_file_functions()
+    elif server == "function":
+        module.initialize_demo_functions()
+    return module
+
+
+# Seeding
+
+def make_vocabulary(rng):
+    return ["".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(4, 9)))
+            for _ in range(VOCABULARY_SIZE)]
+
+
+def make_text(rng, vocabulary, words):
+    lines = []
+    for start in range(0, words, 12):
+        lines.append(" ".join(rng.choice(vocabulary) for _ in range(min(12, words - start))))
+    return "\n".join(lines)
+
+
+def seed_in_process(module, rng, vocabulary, message_count, file_count):
+    conversation_ids = []
+    started = time.time()
+    for first in range(0, max(message_count, 1), MESSAGES_PER_CONVERSATION):
+        conversation_id = str(uuid.UUID(int=rng.getrandbits(128), version=4))
+        now = time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(started + first))
+        module.storage.create_conversation({"id": conversation_id, "created_at": now, "updated_at": now,
+                                            "title": "New Conversation", "metadata": {}})
+        module.storage.add_messages([{
+            "id": str(uuid.UUID(int=rng.getrandbits(128), version=4)),
+            "conversation_id": conversation_id,
+            "created_at": now,
+            "role": "user" if i % 2 == 0 else "assistant",
+            "content": make_text(rng, vocabulary, 20),
+            "metadata": {}
+        } for i in range(min(MESSAGES_PER_CONVERSATION, message_count - first))])
+        conversation_ids.append(conversation_id)
+
+    filenames = []
+    if hasattr(module, "search_index"):
+        for i in range(file_count):
+            filename = f"bench_{i:06d}.txt"
+            with open(os.path.join(module.FILE_DIRECTORY, filename), "w", encoding="utf-8") as file:
+                file.write(make_text(rng, vocabulary, WORDS_PER_FILE))
+            filenames.append(filename)
+        module.search_index.reconcile()
+    return conversation_ids, filenames
+
+
+def seed_over_http(client, rng, vocabulary, message_count, file_count):
+    conversation_ids = []
+    for first in range(0, max(message_count, 1), MESSAGES_PER_CONVERSATION):
+        status, body = client.request("POST", "/api/mcp/v1/conversations")
+        conversation_id = json.loads(body)["id"]
+        for i in range(min(MESSAGES_PER_CONVERSATION, message_count - first)):
+            client.request("POST", f"/api/mcp/v1/conversations/{conversation_id}/messages",
+                           {"role": "user" if i % 2 == 0 else "assistant",
+                            "content": make_text(rng, vocabulary, 20)})
+        conversation_ids.append(conversation_id)
+
+    filenames = []
+    for i in range(file_count):
+        filename = f"bench_{i:06d}.txt"
+        status, _ = client.request("POST", "/api/mcp/v1/function_calls", {
+            "name": "write_file",
+            "parameters": {"filename": filename, "content": make_text(rng, vocabulary, WORDS_PER_FILE)}
+        })
+        if status != 200:
+            break  # not a file server
+        filenames.append(filename)
+    return conversation_ids, filenames
+
+
+# Workload
+
+def operation_request(operation, rng, vocabulary, conversation_ids, filenames):
+    """Return (method, path, body) for one operation"""
+    conversation_id = rng.choice(conversation_ids)
+    if operation == "create_message":
+        return ("POST", f"/api/mcp/v1/conversations/{conversation_id}/messages",
+                {"role": "user", "content": " ".join(rng.choice(vocabulary) for _ in range(20))})
+    if operation == "list_messages":
+        return "GET", f"/api/mcp/v1/conversations/{conversation_id}/messages", None
+    if operation == "read_file":
+        return ("POST", "/api/mcp/v1/function_calls",
+                {"name": "read_file", "parameters": {"filename": rng.choice(filenames)}})
+    if operation == "search_files":
+        return ("POST", "/api/mcp/v1/function_calls",
+                {"name": "search_files", "parameters": {"query": rng.choice(vocabulary)}})
+    if operation == "calculate":
+        return ("POST", "/api/mcp/v1/function_calls",
+                {"name": "calculate", "parameters": {"expression": f"{rng.randint(1, 999)} * {rng.randint(1, 999)}"}})
+    if operation == "create_completion":
+        return ("POST", "/api/mcp/v1/completions", {
+            "conversation_id": conversation_id,
+            "messages": [{"role": "user", "content": f"Please read the file {rng.choice(filenames or ['notes.txt'])}"}]
+        })
+    raise ValueError(f"Unknown operation: {operation}")
+
+
+def run_workload(client, operations, concurrency, request_count, seed, vocabulary, conversation_ids, filenames):
+    names = list(operations)
+    weights = [operations[name] for name in names]
+    counter = itertools.count()
+    latencies = {name: [] for name in names}
+    errors = {name: 0 for name in names}
+    lock = threading.Lock()
+
+    def worker(index):
+        rng = random.Random(seed * 1000 + index)
+        local_latencies = {name: [] for name in names}
+        local_errors = {name: 0 for name in names}
+        while next(counter) < request_count:
+            operation = rng.choices(names, weights)[0]
+            method, path, body = operation_request(operation, rng, vocabulary, conversation_ids, filenames)
+            started = time.perf_counter()
+            try:
+                status, _ = client.request(method, path, body)
+            except Exception:
+                status = None
+            local_latencies[operation].append(time.perf_counter() - started)
+            if status is None or status >= 400:
+                local_errors[operation] += 1
+        with lock:
+            for name in names:
+                latencies[name].extend(local_latencies[name])
+                errors[name] += local_errors[name]
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(worker, range(concurrency)))
+    return time.perf_counter() - started, latencies, errors
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(samples):
+    samples = sorted(samples)
+    if not samples:
+        return {"count": 0}
+    return {
+        "count": len(samples),
+        "mean_ms": round(sum(samples) / len(samples) * 1000, 3),
+        "p50_ms": round(percentile(samples, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(samples, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(samples, 0.99) * 1000, 3),
+    }
+
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in kilobytes on Linux and in bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def compare(result, baseline):
+    """Print the relative change of each figure against a baseline result"""
+    def change(new, old):
+        if new is None or not old:
+            return "n/a"
+        return f"{(new - old) / old:+.1%}"
+
+    print(f"throughput_rps: {baseline['throughput_rps']} -> {result['throughput_rps']} "
+          f"({change(result['throughput_rps'], baseline['throughput_rps'])})", file=sys.stderr)
+    for name, stats in result["operations"].items():
+        old = baseline.get("operations", {}).get(name)
+        if not old or not stats.get("count"):
+            continue
+        figures = ", ".join(f"{key} {change(stats[key], old.get(key))}" for key in ("p50_ms", "p95_ms", "p99_ms"))
+        print(f"{name}: {figures}", file=sys.stderr)
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--server", choices=sorted(SERVER_MODULES), default="file")
+    parser.add_argument("--scale", choices=list(SCALES), default="small")
+    parser.add_argument("--messages", type=int, help="Seeded messages (overrides --scale)")
+    parser.add_argument("--files", type=int, help="Seeded resource files (overrides --scale)")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--url", help="Benchmark a running server instead of importing it")
+    parser.add_argument("--output", help="Also write the JSON result to this file")
+    parser.add_argument("--compare", help="JSON result of an earlier run to compare against")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    message_count, file_count = SCALES[args.scale]
+    if args.messages is not None:
+        message_count = args.messages
+    if args.files is not None:
+        file_count = args.files
+    rng = random.Random(args.seed)
+    vocabulary = make_vocabulary(rng)
+    # Resolved now since in-process runs change into a temporary directory
+    output = os.path.abspath(args.output) if args.output else None
+    baseline_path = os.path.abspath(args.compare) if args.compare else None
+
+    started = time.perf_counter()
+    if args.url:
+        client = HTTPClient(args.url)
+        conversation_ids, filenames = seed_over_http(client, rng, vocabulary, message_count, file_count)
+    else:
+        os.chdir(tempfile.mkdtemp(prefix="mcp-bench-"))
+        module = load_server(args.server)
+        module.app.logger.disabled = True
+        client = InProcessClient(module.app)
+        conversation_ids, filenames = seed_in_process(module, rng, vocabulary, message_count, file_count)
+    seed_seconds = time.perf_counter() - started
+    seeded_rss = None if args.url else peak_rss_mb()
+
+    operations = dict(SERVER_OPERATIONS[args.server])
+    if not filenames:
+        for name in ("read_file", "search_files"):
+            operations.pop(name, None)
+
+    # Request logging would dominate the timings
+    logging.disable(logging.INFO)
+    duration, latencies, errors = run_workload(client, operations, args.concurrency, args.requests, args.seed,
+                                               vocabulary, conversation_ids, filenames)
+    logging.disable(logging.NOTSET)
+
+    total = sum(len(samples) for samples in latencies.values())
+    result = {
+        "server": args.server,
+        "target": args.url or "in-process",
+        "messages": message_count,
+        "files": len(filenames),
+        "concurrency": args.concurrency,
+        "requests": total,
+        "errors": sum(errors.values()),
+        "seed_seconds": round(seed_seconds, 3),
+        "duration_seconds": round(duration, 3),
+        "throughput_rps": round(total / duration, 1) if duration else None,
+        "peak_rss_mb_after_seed": seeded_rss,
+        "peak_rss_mb": None if args.url else peak_rss_mb(),
+        "operations": {name: dict(summarize(samples), errors=errors[name]) for name, samples in latencies.items()},
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+    }
+    print(json.dumps(result, indent=2))
+    if output:
+        with open(output, "w", encoding="utf-8") as file:
+            json.dump(result, file, indent=2)
+    if baseline_path:
+        with open(baseline_path, "r", encoding="utf-8") as file:
+            compare(result, json.load(file))
+
+
+if __name__ == "__main__":
+    main()
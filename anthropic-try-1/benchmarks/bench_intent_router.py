@@ -0,0 +1,84 @@
+"""Compare the compiled IntentRouter with the original any(keyword in ...) loop
+
+Usage: python benchmarks/bench_intent_router.py [--json]
+
+For each keyword count, builds a router with that many synthetic trigger
+phrases spread over 20 intents and times both approaches over the same
+set of messages. Prints microseconds per message.
+"""
+import json
+import os
+import random
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from mcp_intents import IntentRouter
+
+KEYWORD_COUNTS = [10, 100, 1000, 5000]
+MESSAGE_COUNT = 2000
+INTENT_COUNT = 20
+
+
+def random_word(rng, low=4, high=10):
+    return "".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(low, high)))
+
+
+def build_messages(rng, keywords):
+    messages = []
+    for _ in range(MESSAGE_COUNT):
+        words = [random_word(rng, 2, 8) for _ in range(30)]
+        if rng.random() < 0.3:
+            words.insert(rng.randrange(len(words)), rng.choice(keywords))
+        messages.append(" ".join(words))
+    return messages
+
+
+def bench(keyword_count, rng):
+    keywords = [random_word(rng) for _ in range(keyword_count)]
+    by_intent = {f"intent_{i}": keywords[i::INTENT_COUNT] for i in range(INTENT_COUNT)}
+    messages = build_messages(rng, keywords)
+
+    router = IntentRouter()
+    for intent, phrases in by_intent.items():
+        router.add(intent, phrases)
+    router.match("")  # compile outside the timed section
+
+    started = time.perf_counter()
+    expected = [
+        {intent for intent, phrases in by_intent.items() if any(phrase in message.lower() for phrase in phrases)}
+        for message in messages
+    ]
+    loop_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    routed = [router.match(message) for message in messages]
+    router_seconds = time.perf_counter() - started
+
+    if routed != expected:
+        raise AssertionError(f"Router disagrees with the linear loop at {keyword_count} keywords")
+
+    return {
+        "keywords": keyword_count,
+        "loop_us_per_message": round(loop_seconds / MESSAGE_COUNT * 1e6, 2),
+        "router_us_per_message": round(router_seconds / MESSAGE_COUNT * 1e6, 2),
+        "speedup": round(loop_seconds / router_seconds, 1)
+    }
+
+
+def main():
+    rng = random.Random(42)
+    results = [bench(count, rng) for count in KEYWORD_COUNTS]
+    if "--json" in sys.argv:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'keywords':>9} {'loop us/msg':>12} {'router us/msg':>14} {'speedup':>8}")
+    for result in results:
+        print(f"{result['keywords']:>9} {result['loop_us_per_message']:>12} "
+              f"{result['router_us_per_message']:>14} {result['speedup']:>8}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""Measure memory per stored message: plain dicts versus MemoryStorage records
+
+Usage: python benchmarks/bench_message_memory.py [--json] [--messages N]
+
+Builds the same messages twice, once kept as the dicts the servers create
+(the old in-memory representation) and once stored through MemoryStorage,
+and reports the traced allocation per message for each. Both include the
+message content, so the difference is the per-object overhead.
+"""
+from datetime import datetime, timedelta
+import json
+import os
+import random
+import sys
+import tracemalloc
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from mcp_store import MemoryStorage
+
+MESSAGE_COUNT = 100000
+MESSAGES_PER_CONVERSATION = 50
+ROLES = ["user", "assistant"]
+
+
+def build_conversations(rng, message_count):
+    started = datetime(2024, 1, 1)
+    conversations = []
+    messages = []
+    for i in range(0, message_count, MESSAGES_PER_CONVERSATION):
+        conversation_id = str(uuid.UUID(int=rng.getrandbits(128), version=4))
+        now = (started + timedelta(seconds=i)).isoformat()
+        conversations.append({"id": conversation_id, "created_at": now, "updated_at": now,
+                              "title": "New Conversation", "metadata": {}})
+        for j in range(min(MESSAGES_PER_CONVERSATION, message_count - i)):
+            created_at = started + timedelta(seconds=i + j, microseconds=rng.randrange(1000000))
+            messages.append({
+                "id": str(uuid.UUID(int=rng.getrandbits(128), version=4)),
+                "conversation_id": conversation_id,
+                "created_at": created_at.isoformat(),
+                "role": ROLES[j % 2],
+                "content": f"message {i + j}: " + "x" * rng.randrange(20, 80),
+                "metadata": {}
+            })
+    return conversations, messages
+
+
+def measure(store, conversations, messages):
+    """Return the bytes still allocated after storing everything, and the store"""
+    payload = json.dumps([conversations, messages])
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    # Fresh objects, as if parsed from request bodies; whatever the store does
+    # not keep is freed below
+    conversations, messages = json.loads(payload)
+    kept = store(conversations, messages)
+    del conversations, messages
+    used = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+    return used, kept
+
+
+def store_dicts(conversations, messages):
+    by_conversation = {}
+    by_id = {}
+    for message in messages:
+        by_id[message["id"]] = message
+        by_conversation.setdefault(message["conversation_id"], []).append(message)
+    return {conversation["id"]: conversation for conversation in conversations}, by_id, by_conversation
+
+
+def store_records(conversations, messages):
+    storage = MemoryStorage()
+    for conversation in conversations:
+        storage.create_conversation(conversation)
+    storage.add_messages(messages)
+    return storage
+
+
+def main():
+    message_count = MESSAGE_COUNT
+    if "--messages" in sys.argv:
+        message_count = int(sys.argv[sys.argv.index("--messages") + 1])
+    rng = random.Random(42)
+    conversations, messages = build_conversations(rng, message_count)
+
+    dict_bytes, _ = measure(store_dicts, conversations, messages)
+    record_bytes, storage = measure(store_records, conversations, messages)
+
+    # Records must serialize back to exactly the original messages
+    expected_messages = {}
+    for message in messages:
+        expected_messages.setdefault(message["conversation_id"], []).append(message)
+    for conversation in conversations:
+        if storage.list_messages(conversation["id"]) != expected_messages[conversation["id"]]:
+            raise AssertionError(f"Records do not round-trip for conversation {conversation['id']}")
+        if storage.get_conversation(conversation["id"]) != conversation:
+            raise AssertionError(f"Conversation {conversation['id']} does not round-trip")
+
+    result = {
+        "messages": message_count,
+        "dict_bytes_per_message": round(dict_bytes / message_count, 1),
+        "record_bytes_per_message": round(record_bytes / message_count, 1),
+        "saving": round(1 - record_bytes / dict_bytes, 3)
+    }
+    if "--json" in sys.argv:
+        print(json.dumps(result, indent=2))
+        return
+    print(f"{message_count} messages")
+    print(f"  dicts:   {result['dict_bytes_per_message']:>8} bytes/message")
+    print(f"  records: {result['record_bytes_per_message']:>8} bytes/message "
+          f"({result['saving']:.0%} less)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,51 +1,145 @@
 from flask import Flask, request, jsonify
 import uuid
 import json
+import atexit
 import logging
+import time
 import os
+import re
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
+from mcp_context import ContextWindows
+from mcp_file_index import FileSearchIndex
+from mcp_file_io import BlobStore, ContentCache, ContentHashes, DirectoryCache, FileWriter, LineOffsetIndex, read_bytes
+from mcp_functions import FunctionRegistry, function_call_response, run_batch
+from mcp_http import CachedJSONResponse, list_response, ndjson_response, stream_completion
+from mcp_intents import IntentRouter
+from mcp_logging import configure_logging
+from mcp_metrics import Metrics, SlowRequestProfiler, cache_collector, instrument_app, metrics_response, observe_function_calls
+from mcp_search import ParallelSearcher, compile_query
+from mcp_serve import run
+from mcp_store import open_storage
+
 app = Flask(__name__)
-logging.basicConfig(level=logging.INFO)
+configure_logging()
+
+# Prometheus-style metrics served at /metrics. Set MCP_PROFILE_SLOW_MS to also
+# sample the stacks of requests slower than that and log them
+metrics = Metrics()
+SLOW_REQUEST_MS = os.environ.get("MCP_PROFILE_SLOW_MS")
+slow_request_profiler = SlowRequestProfiler(float(SLOW_REQUEST_MS) / 1000) if SLOW_REQUEST_MS else None
+instrument_app(app, metrics, slow_request_profiler)
+
+# Storage for conversations and messages: "memory" (default),
+# "journal:///mcp-journal" to keep it in memory but log every change to disk,
+# "sqlite:///mcp.db" to persist state and share it between worker processes, or
+# "memory?max_conversations=10000&idle_ttl=3600&spill=/path/to/spill.db" caps memory by
+# evicting idle conversations. Paths after "///" are relative; absolute paths take
+# a fourth slash, e.g. "sqlite:////var/lib/mcp/mcp.db" (see open_storage for all options)
+STORAGE_URL = os.environ.get("MCP_STORAGE", "memory")
+storage = open_storage(STORAGE_URL)
+
+# Maps user messages to intents and candidate tools in a single compiled pass
+FILE_INTENT = "files"
+intent_router = IntentRouter()
+intent_router.add(FILE_INTENT, ["file", "document", "text", "read", "write", "search", "list"])
 
-# In-memory storage
-conversations = {}
-messages = {}
-functions = {}
+# Completion context: the last CONTEXT_WINDOW_MESSAGES stored messages plus a summary of older ones
+CONTEXT_WINDOW_MESSAGES = 20
+context_windows = ContextWindows(storage, window_size=CONTEXT_WINDOW_MESSAGES)
+functions = FunctionRegistry(on_call=observe_function_calls(metrics))
+
+# Bounded pool used to run the calls of a batch concurrently
+FUNCTION_CALL_WORKERS = 8
+MAX_BATCH_CALLS = 100
+function_executor = ThreadPoolExecutor(max_workers=FUNCTION_CALL_WORKERS, thread_name_prefix="function-call")
 
 # Configuration for file resources
 FILE_DIRECTORY = "./resources"  # Directory containing text files
 if not os.path.exists(FILE_DIRECTORY):
     os.makedirs(FILE_DIRECTORY)
 
+# Serialized once per registry version and served with ETags, since agents poll these
+functions_listing = CachedJSONResponse(lambda: list(functions.values()), lambda: functions.version)
+system_config = CachedJSONResponse(lambda: {
+    "available_functions": list(functions.values()),
+    "version": "0.1.0",
+    "name": "MCP Server with File System Integration",
+    "file_directory": FILE_DIRECTORY
+}, lambda: functions.version)
+metrics.add_collector(cache_collector("functions_listing", functions_listing.stats))
+metrics.add_collector(cache_collector("system_config", system_config.stats))
+
+# Decoded contents of recently read files, bounded by a byte budget; shared by read_file and search_files
+CONTENT_CACHE_BYTES = 64 * 1024 * 1024
+content_cache = ContentCache(CONTENT_CACHE_BYTES)
+metrics.add_collector(cache_collector("file_content", content_cache.stats))
+
+# Inverted index used by search_files, persisted next to the resources directory
+SEARCH_INDEX_PATH = "./resources.index"
+# How often out-of-band changes to FILE_DIRECTORY are picked up by the index
+SEARCH_INDEX_RECONCILE_SECONDS = 30
+search_index = FileSearchIndex(FILE_DIRECTORY, SEARCH_INDEX_PATH, content_cache=content_cache)
+
+# Process pool that scans files directly for regex, whole-word and case-sensitive searches
+SEARCH_PROCESSES = min(4, os.cpu_count() or 1)
+file_searcher = ParallelSearcher(FILE_DIRECTORY, processes=SEARCH_PROCESSES)
+
+# Sidecar line offsets so read_file can seek straight to a line range
+line_index = LineOffsetIndex("./resources.lines")
+
+# Listings for list_files, revalidated by directory mtime instead of re-stating every file
+directory_cache = DirectoryCache(FILE_DIRECTORY)
+
+# Content hashes returned by read_file, cached per inode
+content_hashes = ContentHashes()
+
+# Set MCP_DEDUPLICATE_FILES=1 to store each distinct file content once, with
+# files hard-linked to content-addressed blobs in ./resources.blobs
+DEDUPLICATE_FILES = os.environ.get("MCP_DEDUPLICATE_FILES") == "1"
+blob_store = BlobStore("./resources.blobs", content_hashes) if DEDUPLICATE_FILES else None
+
+# Atomic, per-path serialized writes; temporary files and chunked uploads are staged here
+file_writer = FileWriter(FILE_DIRECTORY, "./resources.uploads", blobs=blob_store)
+# Uploads with no chunk for this long are abandoned and removed, along with unused lock files
+UPLOAD_MAX_AGE_SECONDS = 24 * 60 * 60
+UPLOAD_CLEANUP_SECONDS = 60 * 60
+
 @app.route("/api/mcp/v1/conversations", methods=["POST"])
 def create_conversation():
     conversation_id = str(uuid.uuid4())
-    conversations[conversation_id] = {
+    now = datetime.now().isoformat()
+    conversation = storage.create_conversation({
         "id": conversation_id,
-        "created_at": datetime.now().isoformat(),
-        "updated_at": datetime.now().isoformat(),
+        "created_at": now,
+        "updated_at": now,
         "title": "New Conversation",
         "metadata": {}
-    }
+    })
     
-    logging.info(f"Created conversation: {conversation_id}")
-    return jsonify(conversations[conversation_id]), 201
+    logging.info("Created conversation: %s", conversation_id)
+    return jsonify(conversation), 201
 
 @app.route("/api/mcp/v1/conversations", methods=["GET"])
 def list_conversations():
-    return jsonify(list(conversations.values())), 200
+    order_by = request.args.get("order_by", "created_at")
+    if order_by not in ("created_at", "updated_at"):
+        return jsonify({"error": f"Invalid order_by: {order_by}"}), 400
+    
+    return list_response(lambda limit, after: storage.list_conversations(order_by, limit, after), sort_key=order_by)
 
 @app.route("/api/mcp/v1/conversations/<conversation_id>", methods=["GET"])
 def get_conversation(conversation_id):
-    if conversation_id not in conversations:
+    conversation = storage.get_conversation(conversation_id)
+    if conversation is None:
         return jsonify({"error": "Conversation not found"}), 404
     
-    return jsonify(conversations[conversation_id]), 200
+    return jsonify(conversation), 200
 
 @app.route("/api/mcp/v1/conversations/<conversation_id>/messages", methods=["POST"])
 def create_message(conversation_id):
-    if conversation_id not in conversations:
+    if storage.get_conversation(conversation_id) is None:
         return jsonify({"error": "Conversation not found"}), 404
     
     data = request.get_json()
@@ -55,101 +149,379 @@ def create_message(conversation_id):
         return jsonify({"error": "Missing required fields"}), 400
     
     message_id = str(uuid.uuid4())
-    messages[message_id] = {
+    message = storage.add_message({
         "id": message_id,
         "conversation_id": conversation_id,
         "created_at": datetime.now().isoformat(),
         "role": data["role"],
         "content": data["content"],
         "metadata": data.get("metadata", {})
-    }
+    })
     
     # Update conversation
-    conversations[conversation_id]["updated_at"] = datetime.now().isoformat()
+    storage.touch_conversation(conversation_id, message["created_at"])
     
-    logging.info(f"Created message: {message_id} in conversation: {conversation_id}")
-    return jsonify(messages[message_id]), 201
+    logging.info("Created message: %s in conversation: %s", message_id, conversation_id)
+    return jsonify(message), 201
 
 @app.route("/api/mcp/v1/conversations/<conversation_id>/messages", methods=["GET"])
 def list_messages(conversation_id):
-    if conversation_id not in conversations:
+    if storage.get_conversation(conversation_id) is None:
         return jsonify({"error": "Conversation not found"}), 404
     
-    # Filter messages by conversation_id
-    conversation_messages = [msg for msg in messages.values() if msg["conversation_id"] == conversation_id]
-    return jsonify(conversation_messages), 200
+    # Messages are indexed by conversation, so only the requested page of its history is read
+    return list_response(lambda limit, after: storage.list_messages(conversation_id, limit, after))
 
 # File resource functions
 
+def list_files(parameters):
+    entries, total, next_cursor = directory_cache.list(
+        recursive=parameters.get("recursive", False),
+        pattern=parameters.get("pattern"),
+        extensions=parameters.get("extensions"),
+        limit=parameters.get("limit"),
+        cursor=parameters.get("cursor")
+    )
+    result = {
+        "success": True,
+        "files": [entry["name"] for entry in entries],
+        "count": len(entries),
+        "total": total
+    }
+    if parameters.get("details"):
+        result["entries"] = entries
+    if next_cursor:
+        result["next_cursor"] = next_cursor
+    return result
+
+def read_file(parameters):
+    filename = parameters["filename"]
+    file_path = os.path.join(FILE_DIRECTORY, filename)
+    if not os.path.exists(file_path):
+        return {"success": False, "error": f"File not found: {filename}"}
+    
+    stat_result = os.stat(file_path)
+    version = file_version(stat_result)
+    if parameters.get("if_version") == version:
+        # The caller already holds this version, so nothing is read or sent
+        return {
+            "success": True,
+            "filename": filename,
+            "unchanged": True,
+            "version": version,
+            "size": stat_result.st_size
+        }
+    
+    # Hashing reads the whole file, so it is only done when the hash is asked for or used as the cache key
+    content_hash = None
+    if any(key in parameters for key in ("offset", "length", "start_line", "end_line")):
+        result = read_file_range(filename, file_path, parameters, stat_result)
+    else:
+        # Files with the same content share one cache entry when keyed by hash
+        if blob_store is not None:
+            content_hash = content_hashes.get(file_path, stat_result)
+        content = content_cache.read(file_path, stat_result, key=content_hash)
+        result = {
+            "success": True,
+            "filename": filename,
+            "content": content,
+            "size": stat_result.st_size
+        }
+    if result["success"]:
+        result["version"] = version
+        if parameters.get("include_hash"):
+            result["content_hash"] = content_hash or content_hashes.get(file_path, stat_result)
+    return result
+
+def file_version(stat_result):
+    """Version token that changes whenever a file is written or replaced, computed without reading it"""
+    return f"{stat_result.st_ino:x}-{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}"
+
+def read_file_range(filename, file_path, parameters, stat_result):
+    """Read a byte range or line range of a file without loading the whole file"""
+    size = stat_result.st_size
+    by_lines = "start_line" in parameters or "end_line" in parameters
+    if by_lines and ("offset" in parameters or "length" in parameters):
+        return {"success": False, "error": "Use either offset/length or start_line/end_line, not both"}
+    
+    if by_lines:
+        start_line = parameters.get("start_line", 1)
+        end_line = parameters.get("end_line", start_line)
+        if end_line < start_line:
+            return {"success": False, "error": "end_line must not be less than start_line"}
+        start, end, total_lines = line_index.line_range(file_path, filename, start_line, end_line, stat_result)
+        content, start, end = read_bytes(file_path, start, end, size)
+        return {
+            "success": True,
+            "filename": filename,
+            "content": content,
+            "size": size,
+            "start_line": start_line,
+            "end_line": min(end_line, total_lines),
+            "total_lines": total_lines
+        }
+    
+    offset = parameters.get("offset", 0)
+    length = parameters.get("length", size)
+    content, start, end = read_bytes(file_path, offset, offset + length, size)
+    result = {
+        "success": True,
+        "filename": filename,
+        "content": content,
+        "size": size,
+        "offset": start,
+        "length": end - start
+    }
+    if end < size:
+        # Lets clients read a large file in chunks
+        result["next_offset"] = end
+    return result
+
+def start_search(parameters):
+    """Return an iterator of search results that ends with a summary record
+
+    Raises re.error for an invalid regular expression before any work starts.
+    """
+    query = parameters["query"]
+    max_results = parameters.get("max_results")
+    if parameters.get("regex") or parameters.get("whole_word") or parameters.get("case_sensitive"):
+        # The index only knows lowercased text, so these are answered by scanning the files
+        source, flags = compile_query(query, parameters.get("regex", False),
+                                      parameters.get("whole_word", False), parameters.get("case_sensitive", False))
+        return file_searcher.search(source, flags, max_results, parameters.get("timeout"))
+    return search_index_results(query, parameters.get("match", "substring"), max_results)
+
+def search_index_results(query, match, max_results):
+    # Answered from the inverted index, ranked by match count
+    with metrics.time("search_index"):
+        results = search_index.search(query, match)
+    yield from results[:max_results]
+    yield {"done": True, "timed_out": False, "truncated": max_results is not None and len(results) > max_results}
+
+def search_files(parameters):
+    query = parameters["query"]
+    try:
+        records = list(start_search(parameters))
+    except re.error as e:
+        return {"success": False, "error": f"Invalid regular expression: {e}"}
+    summary = records.pop()
+    search_results = sorted(records, key=lambda result: result["matches"], reverse=True)
+    return {
+        "success": True,
+        "query": query,
+        "results": search_results,
+        "total_matches": len(search_results),
+        "timed_out": summary["timed_out"],
+        "truncated": summary["truncated"]
+    }
+
+def write_file(parameters):
+    filename = parameters["filename"]
+    content = parameters["content"]
+    mode = parameters.get("mode", "overwrite")
+    if mode == "patch" and "offset" not in parameters:
+        return {"success": False, "error": "Missing required parameter: offset"}
+    
+    try:
+        with metrics.time("write_file"):
+            if mode == "append":
+                file_size = file_writer.append(filename, content)
+            elif mode == "patch":
+                file_size = file_writer.patch(filename, parameters["offset"], content)
+            else:
+                file_size = file_writer.write(filename, content)
+    except ValueError as e:
+        return {"success": False, "error": str(e)}
+    file_changed(filename)
+    
+    return {
+        "success": True,
+        "filename": filename,
+        "size": len(content),
+        "file_size": file_size,
+        "version": file_version(os.stat(os.path.join(FILE_DIRECTORY, filename))),
+        "message": f"Successfully wrote to {filename}"
+    }
+
+def file_changed(filename):
+    """Drop cached state for a file that was just written"""
+    content_cache.invalidate(os.path.join(FILE_DIRECTORY, filename))
+    directory_cache.invalidate(os.path.dirname(filename))
+    # Only the file just written is reindexed
+    search_index.index_file(filename)
+
 def register_file_functions():
     """Register functions for interacting with text files"""
     
     # Function to list available files
-    functions["list_files"] = {
-        "name": "list_files",
-        "description": "List all available text files in the resources directory",
-        "parameters": {
+    functions.register(
+        "list_files",
+        "List all available text files in the resources directory",
+        {
             "type": "object",
-            "properties": {},
+            "properties": {
+                "recursive": {
+                    "type": "boolean",
+                    "description": "Include files in subdirectories"
+                },
+                "pattern": {
+                    "type": "string",
+                    "description": "fnmatch-style pattern for file names, e.g. *.txt (matched against the relative path if it contains /)"
+                },
+                "extensions": {
+                    "type": "array",
+                    "items": {"type": "string"},
+                    "description": "Only include files with these extensions, e.g. [\".txt\", \".md\"]"
+                },
+                "details": {
+                    "type": "boolean",
+                    "description": "Also return size and modification time for each file"
+                },
+                "limit": {
+                    "type": "integer",
+                    "minimum": 1,
+                    "description": "Maximum number of files to return"
+                },
+                "cursor": {
+                    "type": "string",
+                    "description": "next_cursor from a previous call, to fetch the next page"
+                }
+            },
             "required": []
-        }
-    }
+        },
+        list_files
+    )
+    intent_router.add("list_files", ["list", "what files", "which files", "available files"])
     
     # Function to read a file
-    functions["read_file"] = {
-        "name": "read_file",
-        "description": "Read the content of a text file",
-        "parameters": {
+    functions.register(
+        "read_file",
+        "Read the content of a text file",
+        {
             "type": "object",
             "properties": {
                 "filename": {
                     "type": "string",
+                    "minLength": 1,
                     "description": "Name of the file to read (including extension)"
+                },
+                "offset": {
+                    "type": "integer",
+                    "minimum": 0,
+                    "description": "Byte offset to start reading from"
+                },
+                "length": {
+                    "type": "integer",
+                    "minimum": 0,
+                    "description": "Maximum number of bytes to read"
+                },
+                "start_line": {
+                    "type": "integer",
+                    "minimum": 1,
+                    "description": "First line to read (1-based)"
+                },
+                "end_line": {
+                    "type": "integer",
+                    "minimum": 1,
+                    "description": "Last line to read (inclusive)"
+                },
+                "include_hash": {
+                    "type": "boolean",
+                    "description": "Also return the SHA-256 hash of the whole file's content"
+                },
+                "if_version": {
+                    "type": "string",
+                    "description": "Version from an earlier read; if the file has not changed since, no content is returned"
                 }
             },
             "required": ["filename"]
-        }
-    }
+        },
+        read_file
+    )
+    intent_router.add("read_file", ["read", "show me", "open", "content of", "contents of"])
     
     # Function to search within files
-    functions["search_files"] = {
-        "name": "search_files",
-        "description": "Search for text across all files",
-        "parameters": {
+    functions.register(
+        "search_files",
+        "Search for text across all files",
+        {
             "type": "object",
             "properties": {
                 "query": {
                     "type": "string",
+                    "minLength": 1,
                     "description": "Text to search for"
+                },
+                "match": {
+                    "type": "string",
+                    "enum": ["substring", "term"],
+                    "description": "Match the query anywhere in the text (default) or only as whole words"
+                },
+                "regex": {
+                    "type": "boolean",
+                    "description": "Treat the query as a regular expression"
+                },
+                "whole_word": {
+                    "type": "boolean",
+                    "description": "Only match the query at word boundaries"
+                },
+                "case_sensitive": {
+                    "type": "boolean",
+                    "description": "Match letter case exactly (searches ignore case by default)"
+                },
+                "max_results": {
+                    "type": "integer",
+                    "minimum": 1,
+                    "description": "Stop once this many files have matched"
+                },
+                "timeout": {
+                    "type": "number",
+                    "minimum": 0,
+                    "description": "Stop scanning after this many seconds and return what was found"
                 }
             },
             "required": ["query"]
-        }
-    }
+        },
+        search_files
+    )
+    intent_router.add("search_files", ["search", "find", "look for", "grep"])
     
     # Function to write to a file
-    functions["write_file"] = {
-        "name": "write_file",
-        "description": "Write content to a text file (creates or overwrites)",
-        "parameters": {
+    functions.register(
+        "write_file",
+        "Write content to a text file (creates or overwrites)",
+        {
             "type": "object",
             "properties": {
                 "filename": {
                     "type": "string",
+                    "minLength": 1,
                     "description": "Name of the file to write (including extension)"
                 },
                 "content": {
                     "type": "string",
                     "description": "Content to write to the file"
+                },
+                "mode": {
+                    "type": "string",
+                    "enum": ["overwrite", "append", "patch"],
+                    "description": "Replace the file (default), append to it, or overwrite the bytes at offset"
+                },
+                "offset": {
+                    "type": "integer",
+                    "minimum": 0,
+                    "description": "Byte offset where a patch starts"
                 }
             },
             "required": ["filename", "content"]
-        }
-    }
+        },
+        write_file
+    )
+    intent_router.add("write_file", ["write", "create a file", "save", "update the file"])
 
 @app.route("/api/mcp/v1/functions", methods=["GET"])
 def list_functions():
-    return jsonify(list(functions.values())), 200
+    return functions_listing.response()
 
 @app.route("/api/mcp/v1/functions/<function_id>", methods=["GET"])
 def get_function(function_id):
@@ -172,115 +544,126 @@ def execute_function():
     if function_name not in functions:
         return jsonify({"error": f"Function not found: {function_name}"}), 404
     
-    result = {"success": False, "error": "Function execution not implemented"}
+    # Validates against the compiled schema and dispatches to the registered handler
+    response = function_call_response(functions, function_name, parameters)
     
+    logging.info("Executed function: %s", function_name)
+    return jsonify(response), 200
+
+@app.route("/api/mcp/v1/function_calls/batch", methods=["POST"])
+def execute_function_batch():
+    data = request.get_json()
+    
+    # Validate request
+    if not isinstance(data, dict):
+        return jsonify({"error": "Request body must be a JSON object"}), 400
+    calls = data.get("calls")
+    if not isinstance(calls, list):
+        return jsonify({"error": "Missing required field: calls"}), 400
+    if len(calls) > MAX_BATCH_CALLS:
+        return jsonify({"error": f"A batch can contain at most {MAX_BATCH_CALLS} calls"}), 400
+    
+    # Independent calls run concurrently; results come back in request order
+    started = time.perf_counter()
+    responses = run_batch(functions, calls, function_executor, parallel=data.get("parallel", True) is not False)
+    duration_ms = round((time.perf_counter() - started) * 1000, 3)
+    
+    logging.info("Executed batch of %s function calls in %s ms", len(calls), duration_ms)
+    return jsonify({"results": responses, "count": len(responses), "duration_ms": duration_ms}), 200
+
+@app.route("/api/mcp/v1/uploads", methods=["POST"])
+def begin_upload():
+    data = request.get_json()
+    
+    # Validate request
+    if not isinstance(data.get("filename"), str) or not data["filename"]:
+        return jsonify({"error": "Missing required fields"}), 400
+    
+    upload_id = file_writer.begin_upload(data["filename"])
+    return jsonify(file_writer.upload_status(upload_id)), 201
+
+@app.route("/api/mcp/v1/uploads/<upload_id>", methods=["GET"])
+def get_upload(upload_id):
     try:
-        # Implement file-based functions
-        if function_name == "list_files":
-            files = [f for f in os.listdir(FILE_DIRECTORY) if os.path.isfile(os.path.join(FILE_DIRECTORY, f))]
-            result = {
-                "success": True,
-                "files": files,
-                "count": len(files)
-            }
-        
-        elif function_name == "read_file":
-            filename = parameters.get("filename")
-            if not filename:
-                result = {"success": False, "error": "Filename is required"}
-            else:
-                file_path = os.path.join(FILE_DIRECTORY, filename)
-                if not os.path.exists(file_path):
-                    result = {"success": False, "error": f"File not found: {filename}"}
-                else:
-                    with open(file_path, 'r', encoding='utf-8') as file:
-                        content = file.read()
-                    result = {
-                        "success": True,
-                        "filename": filename,
-                        "content": content,
-                        "size": len(content)
-                    }
-        
-        elif function_name == "search_files":
-            query = parameters.get("query")
-            if not query:
-                result = {"success": False, "error": "Search query is required"}
-            else:
-                search_results = []
-                for filename in os.listdir(FILE_DIRECTORY):
-                    file_path = os.path.join(FILE_DIRECTORY, filename)
-                    if os.path.isfile(file_path):
-                        try:
-                            with open(file_path, 'r', encoding='utf-8') as file:
-                                content = file.read()
-                                if query.lower() in content.lower():
-                                    search_results.append({
-                                        "filename": filename,
-                                        "matches": content.lower().count(query.lower())
-                                    })
-                        except Exception as e:
-                            logging.error(f"Error reading file {filename}: {str(e)}")
-                
-                result = {
-                    "success": True,
-                    "query": query,
-                    "results": search_results,
-                    "total_matches": len(search_results)
-                }
-        
-        elif function_name == "write_file":
-            filename = parameters.get("filename")
-            content = parameters.get("content")
-            
-            if not filename or content is None:
-                result = {"success": False, "error": "Filename and content are required"}
-            else:
-                file_path = os.path.join(FILE_DIRECTORY, filename)
-                with open(file_path, 'w', encoding='utf-8') as file:
-                    file.write(content)
-                
-                result = {
-                    "success": True,
-                    "filename": filename,
-                    "size": len(content),
-                    "message": f"Successfully wrote to {filename}"
-                }
-        
-        else:
-            result = {"success": False, "error": f"Function implementation not found for {function_name}"}
-    
-    except Exception as e:
-        result = {"success": False, "error": str(e)}
-    
-    response = {
-        "id": str(uuid.uuid4()),
-        "function": function_name,
-        "result": result,
-        "timestamp": datetime.now().isoformat()
-    }
+        return jsonify(file_writer.upload_status(upload_id)), 200
+    except KeyError:
+        return jsonify({"error": "Upload not found"}), 404
+
+@app.route("/api/mcp/v1/uploads/<upload_id>", methods=["PUT"])
+def upload_chunk(upload_id):
+    # The raw request body is the chunk; ?offset= must match the bytes received so far
+    offset = request.args.get("offset", type=int)
+    if offset is None:
+        return jsonify({"error": "Missing required parameter: offset"}), 400
     
-    logging.info(f"Executed function: {function_name}")
-    return jsonify(response), 200
+    try:
+        received = file_writer.write_chunk(upload_id, request.stream, offset)
+    except KeyError:
+        return jsonify({"error": "Upload not found"}), 404
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 409
+    return jsonify({"upload_id": upload_id, "received": received}), 200
+
+@app.route("/api/mcp/v1/uploads/<upload_id>/complete", methods=["POST"])
+def complete_upload(upload_id):
+    try:
+        filename, size = file_writer.complete_upload(upload_id)
+    except KeyError:
+        return jsonify({"error": "Upload not found"}), 404
+    file_changed(filename)
+    
+    logging.info("Completed upload of %s (%s bytes)", filename, size)
+    return jsonify({"success": True, "filename": filename, "file_size": size}), 200
+
+@app.route("/api/mcp/v1/uploads/<upload_id>", methods=["DELETE"])
+def abort_upload(upload_id):
+    try:
+        file_writer.abort_upload(upload_id)
+    except KeyError:
+        return jsonify({"error": "Upload not found"}), 404
+    return "", 204
+
+@app.route("/api/mcp/v1/search", methods=["POST"])
+def stream_search():
+    data = request.get_json()
+    
+    # Validate request against the search_files schema
+    if "search_files" not in functions:
+        return jsonify({"error": "Function not found: search_files"}), 404
+    error = functions.validate("search_files", data)
+    if error:
+        return jsonify({"error": error}), 400
+    
+    try:
+        records = start_search(data)
+    except re.error as e:
+        return jsonify({"error": f"Invalid regular expression: {e}"}), 400
+    
+    # Each matching file is sent as soon as it is found, followed by a summary line
+    return ndjson_response(records)
 
 @app.route("/api/mcp/v1/completions", methods=["POST"])
 def create_completion():
     data = request.get_json()
     
-    # Validate request
-    if "conversation_id" not in data or "messages" not in data:
+    # Validate request; messages is optional since context comes from stored history
+    if "conversation_id" not in data:
         return jsonify({"error": "Missing required fields"}), 400
+    if not isinstance(data.get("messages", []), list):
+        return jsonify({"error": "messages must be a list"}), 400
     
     conversation_id = data["conversation_id"]
-    if conversation_id not in conversations:
+    if storage.get_conversation(conversation_id) is None:
         return jsonify({"error": "Conversation not found"}), 404
     
-    user_messages = [msg for msg in data["messages"] if msg.get("role") == "user"]
-    latest_user_message = user_messages[-1]["content"] if user_messages else ""
+    # Context is the stored rolling window plus any not-yet-stored messages sent with the request
+    context = context_windows.get(conversation_id)
+    latest_user_message = latest_user_content(context["messages"], data.get("messages", []))
     
-    # Check if the message might be asking about files
-    file_related_keywords = ["file", "document", "text", "read", "write", "search", "list"]
-    is_file_related = any(keyword in latest_user_message.lower() for keyword in file_related_keywords)
+    # Check if the message might be asking about files, and which file functions could help
+    intents = intent_router.match(latest_user_message)
+    is_file_related = FILE_INTENT in intents
+    candidate_tools = sorted(intent for intent in intents if intent in functions)
     
     message_id = str(uuid.uuid4())
     
@@ -292,32 +675,61 @@ def create_completion():
         content += "I can list files, read file content, search across files, or write to files. "
         content += "Would you like me to perform any of these operations for you?"
     
+    metadata = {"candidate_tools": candidate_tools} if candidate_tools else {}
+    if context["summary"]:
+        # Older history the reply was built from, beyond the messages in the window
+        metadata["context_summary"] = context["summary"]
+    
     response_message = {
         "id": message_id,
         "conversation_id": conversation_id,
         "created_at": datetime.now().isoformat(),
         "role": "assistant",
         "content": content,
-        "metadata": {}
+        "metadata": metadata
     }
     
+    if data.get("stream") is True:
+        # Stream the reply as SSE; it is stored only once the whole message has been sent
+        return stream_completion(response_message, store_completion)
+    
+    store_completion(response_message)
+    return jsonify(response_message), 201
+
+def latest_user_content(*message_lists):
+    """Content of the most recent user message in message_lists, which are ordered oldest first"""
+    for message_list in reversed(message_lists):
+        for message in reversed(message_list):
+            if isinstance(message, dict) and message.get("role") == "user":
+                content = message.get("content", "")
+                return content if isinstance(content, str) else ""
+    return ""
+
+def store_completion(message):
     # Store the message
-    messages[message_id] = response_message
+    storage.add_message(message)
     
     # Update conversation
-    conversations[conversation_id]["updated_at"] = datetime.now().isoformat()
+    storage.touch_conversation(message["conversation_id"], message["created_at"])
     
-    logging.info(f"Created completion message: {message_id} in conversation: {conversation_id}")
-    return jsonify(response_message), 201
+    logging.info("Created completion message: %s in conversation: %s", message["id"], message["conversation_id"])
 
 @app.route("/api/mcp/v1/system/config", methods=["GET"])
 def get_system_config():
-    return jsonify({
-        "available_functions": list(functions.values()),
-        "version": "0.1.0",
-        "name": "MCP Server with File System Integration",
-        "file_directory": FILE_DIRECTORY
-    }), 200
+    return system_config.response()
+
+@app.route("/api/mcp/v1/system/storage", methods=["GET"])
+def get_storage_stats():
+    # Conversation and message counts, plus eviction counters for bounded memory storage
+    return jsonify(storage.stats()), 200
+
+@app.route("/metrics", methods=["GET"])
+def get_metrics():
+    return metrics_response(metrics)
+
+@app.route("/api/mcp/v1/system/cache", methods=["GET"])
+def get_cache_stats():
+    return jsonify(content_cache.stats()), 200
 
 # Create a sample text file for testing
 def create_sample_files():
@@ -328,17 +740,39 @@ def create_sample_files():
     }
     
     for filename, content in sample_files.items():
-        file_path = os.path.join(FILE_DIRECTORY, filename)
-        with open(file_path, 'w', encoding='utf-8') as file:
-            file.write(content)
+        file_writer.write(filename, content)
+        file_changed(filename)
     
-    logging.info(f"Created {len(sample_files)} sample files in {FILE_DIRECTORY}")
+    logging.info("Created %s sample files in %s", len(sample_files), FILE_DIRECTORY)
+
+def start_background_tasks():
+    # Fork the search processes before any background thread is running
+    file_searcher.start()
+    search_index.start_auto_reconcile(SEARCH_INDEX_RECONCILE_SECONDS)
+    file_writer.start_auto_cleanup(UPLOAD_CLEANUP_SECONDS, UPLOAD_MAX_AGE_SECONDS)
+
+def stop_background_tasks():
+    search_index.stop_auto_reconcile()
+    file_writer.stop_auto_cleanup()
+    search_index.save()
+    file_searcher.shutdown()
+    function_executor.shutdown(wait=True)
 
 if __name__ == "__main__":
     # Register file functions
     register_file_functions()
     
+    # Load the persisted search index; only files changed since it was saved are reindexed
+    search_index.load()
+    
     # Create sample files
     create_sample_files()
     
-    app.run(debug=True, host="0.0.0.0", port=5000)
+    search_index.reconcile()
+    search_index.save()
+    if blob_store is not None:
+        blob_store.collect()
+    atexit.register(search_index.save)
+    
+    # Pass --production to serve with gunicorn worker processes
+    run(app, on_worker_start=start_background_tasks, on_worker_exit=stop_background_tasks)
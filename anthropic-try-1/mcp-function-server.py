@@ -1,45 +1,99 @@
 from flask import Flask, request, jsonify
 import uuid
+import ast
 import json
 import logging
+import math
+import os
+import time
+import operator
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
+from mcp_functions import FunctionRegistry, function_call_response, run_batch
+from mcp_http import CachedJSONResponse, list_response, stream_completion
+from mcp_logging import configure_logging
+from mcp_metrics import Metrics, SlowRequestProfiler, cache_collector, instrument_app, metrics_response, observe_function_calls
+from mcp_serve import run
+from mcp_store import open_storage
+
 app = Flask(__name__)
-logging.basicConfig(level=logging.INFO)
+configure_logging()
+
+# Prometheus-style metrics served at /metrics. Set MCP_PROFILE_SLOW_MS to also
+# sample the stacks of requests slower than that and log them
+metrics = Metrics()
+SLOW_REQUEST_MS = os.environ.get("MCP_PROFILE_SLOW_MS")
+slow_request_profiler = SlowRequestProfiler(float(SLOW_REQUEST_MS) / 1000) if SLOW_REQUEST_MS else None
+instrument_app(app, metrics, slow_request_profiler)
+
+# Storage for conversations, messages and functions: "memory" (default),
+# "journal:///mcp-journal" to keep it in memory but log every change to disk,
+# "sqlite:///mcp.db" to persist state and share it between worker processes, or
+# "memory?max_conversations=10000&idle_ttl=3600&spill=/path/to/spill.db" caps memory by
+# evicting idle conversations. Paths after "///" are relative; absolute paths take
+# a fourth slash, e.g. "sqlite:////var/lib/mcp/mcp.db" (see open_storage for all options)
+STORAGE_URL = os.environ.get("MCP_STORAGE", "memory")
+storage = open_storage(STORAGE_URL)
+
+def echo_handler(function_name):
+    """Handler for functions without an implementation: echo back the call"""
+    def echo(parameters):
+        return f"Executed {function_name} with parameters: {json.dumps(parameters)}"
+    return echo
 
-# In-memory storage
-conversations = {}
-messages = {}
-functions = {}  # Store registered functions
+# Registered functions and their handlers; definitions are kept in storage too
+functions = FunctionRegistry(storage, default_handler=echo_handler, on_call=observe_function_calls(metrics))
+
+# Bounded pool used to run the calls of a batch concurrently
+FUNCTION_CALL_WORKERS = 8
+MAX_BATCH_CALLS = 100
+function_executor = ThreadPoolExecutor(max_workers=FUNCTION_CALL_WORKERS, thread_name_prefix="function-call")
+
+# Serialized once per registry version and served with ETags, since agents poll these
+functions_listing = CachedJSONResponse(lambda: list(functions.values()), lambda: functions.version)
+system_config = CachedJSONResponse(lambda: {
+    "available_functions": list(functions.values()),
+    "version": "0.1.0",
+    "name": "Simple MCP Server with Function Support"
+}, lambda: functions.version)
+metrics.add_collector(cache_collector("functions_listing", functions_listing.stats))
+metrics.add_collector(cache_collector("system_config", system_config.stats))
 
 @app.route("/api/mcp/v1/conversations", methods=["POST"])
 def create_conversation():
     conversation_id = str(uuid.uuid4())
-    conversations[conversation_id] = {
+    now = datetime.now().isoformat()
+    conversation = storage.create_conversation({
         "id": conversation_id,
-        "created_at": datetime.now().isoformat(),
-        "updated_at": datetime.now().isoformat(),
+        "created_at": now,
+        "updated_at": now,
         "title": "New Conversation",
         "metadata": {}
-    }
+    })
     
-    logging.info(f"Created conversation: {conversation_id}")
-    return jsonify(conversations[conversation_id]), 201
+    logging.info("Created conversation: %s", conversation_id)
+    return jsonify(conversation), 201
 
 @app.route("/api/mcp/v1/conversations", methods=["GET"])
 def list_conversations():
-    return jsonify(list(conversations.values())), 200
+    order_by = request.args.get("order_by", "created_at")
+    if order_by not in ("created_at", "updated_at"):
+        return jsonify({"error": f"Invalid order_by: {order_by}"}), 400
+    
+    return list_response(lambda limit, after: storage.list_conversations(order_by, limit, after), sort_key=order_by)
 
 @app.route("/api/mcp/v1/conversations/<conversation_id>", methods=["GET"])
 def get_conversation(conversation_id):
-    if conversation_id not in conversations:
+    conversation = storage.get_conversation(conversation_id)
+    if conversation is None:
         return jsonify({"error": "Conversation not found"}), 404
     
-    return jsonify(conversations[conversation_id]), 200
+    return jsonify(conversation), 200
 
 @app.route("/api/mcp/v1/conversations/<conversation_id>/messages", methods=["POST"])
 def create_message(conversation_id):
-    if conversation_id not in conversations:
+    if storage.get_conversation(conversation_id) is None:
         return jsonify({"error": "Conversation not found"}), 404
     
     data = request.get_json()
@@ -49,29 +103,28 @@ def create_message(conversation_id):
         return jsonify({"error": "Missing required fields"}), 400
     
     message_id = str(uuid.uuid4())
-    messages[message_id] = {
+    message = storage.add_message({
         "id": message_id,
         "conversation_id": conversation_id,
         "created_at": datetime.now().isoformat(),
         "role": data["role"],
         "content": data["content"],
         "metadata": data.get("metadata", {})
-    }
+    })
     
     # Update conversation
-    conversations[conversation_id]["updated_at"] = datetime.now().isoformat()
+    storage.touch_conversation(conversation_id, message["created_at"])
     
-    logging.info(f"Created message: {message_id} in conversation: {conversation_id}")
-    return jsonify(messages[message_id]), 201
+    logging.info("Created message: %s in conversation: %s", message_id, conversation_id)
+    return jsonify(message), 201
 
 @app.route("/api/mcp/v1/conversations/<conversation_id>/messages", methods=["GET"])
 def list_messages(conversation_id):
-    if conversation_id not in conversations:
+    if storage.get_conversation(conversation_id) is None:
         return jsonify({"error": "Conversation not found"}), 404
     
-    # Filter messages by conversation_id
-    conversation_messages = [msg for msg in messages.values() if msg["conversation_id"] == conversation_id]
-    return jsonify(conversation_messages), 200
+    # Messages are indexed by conversation, so only the requested page of its history is read
+    return list_response(lambda limit, after: storage.list_messages(conversation_id, limit, after))
 
 # New endpoints for function registration and handling
 
@@ -86,18 +139,18 @@ def register_function():
             return jsonify({"error": f"Missing required field: {field}"}), 400
     
     function_id = data.get("name")
-    functions[function_id] = {
-        "name": data["name"],
-        "description": data["description"],
-        "parameters": data["parameters"]
-    }
+    try:
+        # Functions registered over HTTP have no implementation here, so calls are echoed back
+        functions.register(data["name"], data["description"], data["parameters"], echo_handler(function_id))
+    except ValueError as e:
+        return jsonify({"error": f"Invalid parameters schema: {str(e)}"}), 400
     
-    logging.info(f"Registered function: {function_id}")
+    logging.info("Registered function: %s", function_id)
     return jsonify(functions[function_id]), 201
 
 @app.route("/api/mcp/v1/functions", methods=["GET"])
 def list_functions():
-    return jsonify(list(functions.values())), 200
+    return functions_listing.response()
 
 @app.route("/api/mcp/v1/functions/<function_id>", methods=["GET"])
 def get_function(function_id):
@@ -120,18 +173,32 @@ def execute_function():
     if function_name not in functions:
         return jsonify({"error": f"Function not found: {function_name}"}), 404
     
-    # In a real implementation, you would execute the function here
-    # For this demo, we'll just echo back that we received the call
+    # Validates against the compiled schema and dispatches to the registered handler
+    response = function_call_response(functions, function_name, parameters)
     
-    result = {
-        "id": str(uuid.uuid4()),
-        "function": function_name,
-        "result": f"Executed {function_name} with parameters: {json.dumps(parameters)}",
-        "timestamp": datetime.now().isoformat()
-    }
+    logging.info("Executed function: %s", function_name)
+    return jsonify(response), 200
+
+@app.route("/api/mcp/v1/function_calls/batch", methods=["POST"])
+def execute_function_batch():
+    data = request.get_json()
     
-    logging.info(f"Executed function: {function_name}")
-    return jsonify(result), 200
+    # Validate request
+    if not isinstance(data, dict):
+        return jsonify({"error": "Request body must be a JSON object"}), 400
+    calls = data.get("calls")
+    if not isinstance(calls, list):
+        return jsonify({"error": "Missing required field: calls"}), 400
+    if len(calls) > MAX_BATCH_CALLS:
+        return jsonify({"error": f"A batch can contain at most {MAX_BATCH_CALLS} calls"}), 400
+    
+    # Independent calls run concurrently; results come back in request order
+    started = time.perf_counter()
+    responses = run_batch(functions, calls, function_executor, parallel=data.get("parallel", True) is not False)
+    duration_ms = round((time.perf_counter() - started) * 1000, 3)
+    
+    logging.info("Executed batch of %s function calls in %s ms", len(calls), duration_ms)
+    return jsonify({"results": responses, "count": len(responses), "duration_ms": duration_ms}), 200
 
 @app.route("/api/mcp/v1/completions", methods=["POST"])
 def create_completion():
@@ -142,7 +209,7 @@ def create_completion():
         return jsonify({"error": "Missing required fields"}), 400
     
     conversation_id = data["conversation_id"]
-    if conversation_id not in conversations:
+    if storage.get_conversation(conversation_id) is None:
         return jsonify({"error": "Conversation not found"}), 404
     
     available_functions = list(functions.values()) if functions else []
@@ -183,31 +250,113 @@ def create_completion():
             }
         ]
     
+    if data.get("stream") is True:
+        # Stream the reply as SSE; it is stored only once the whole message has been sent
+        return stream_completion(response_message, store_completion)
+    
+    store_completion(response_message)
+    return jsonify(response_message), 201
+
+def store_completion(message):
     # Store the message
-    messages[message_id] = response_message
+    storage.add_message(message)
     
     # Update conversation
-    conversations[conversation_id]["updated_at"] = datetime.now().isoformat()
+    storage.touch_conversation(message["conversation_id"], message["created_at"])
     
-    logging.info(f"Created completion message: {message_id} in conversation: {conversation_id}")
-    return jsonify(response_message), 201
+    logging.info("Created completion message: %s in conversation: %s", message["id"], message["conversation_id"])
 
 # Add a system configuration endpoint that provides available functions
 @app.route("/api/mcp/v1/system/config", methods=["GET"])
 def get_system_config():
-    return jsonify({
-        "available_functions": list(functions.values()),
-        "version": "0.1.0",
-        "name": "Simple MCP Server with Function Support"
-    }), 200
+    return system_config.response()
+
+@app.route("/api/mcp/v1/system/storage", methods=["GET"])
+def get_storage_stats():
+    # Conversation and message counts, plus eviction counters for bounded memory storage
+    return jsonify(storage.stats()), 200
+
+@app.route("/metrics", methods=["GET"])
+def get_metrics():
+    return metrics_response(metrics)
+
+def get_weather(parameters):
+    # Simulated weather data; a real implementation would call a weather service
+    unit = parameters.get("unit", "fahrenheit")
+    return {
+        "success": True,
+        "location": parameters["location"],
+        "temperature": 22 if unit == "celsius" else 72,
+        "unit": unit,
+        "conditions": "sunny"
+    }
+
+CALCULATOR_OPERATORS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv,
+    ast.Mod: operator.mod,
+    ast.Pow: operator.pow,
+    ast.USub: operator.neg,
+    ast.UAdd: operator.pos
+}
+
+# Integers are limited to this many bits (about 3000 digits), well below the
+# 4300 digits Python will convert to a string, so results always serialize
+CALCULATOR_MAX_BITS = 10000
+
+def evaluate_expression(node):
+    """Evaluate an arithmetic expression tree without using eval"""
+    if isinstance(node, ast.Expression):
+        return evaluate_expression(node.body)
+    if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)) and not isinstance(node.value, bool):
+        return check_result_size(node.value)
+    if isinstance(node, ast.BinOp) and type(node.op) in CALCULATOR_OPERATORS:
+        left = evaluate_expression(node.left)
+        right = evaluate_expression(node.right)
+        # Estimate the size of integer products and powers before computing them,
+        # since computing an oversized one is what takes the time
+        if isinstance(left, int) and isinstance(right, int):
+            if isinstance(node.op, ast.Pow) and right > 0 and abs(left) > 1 and \
+                    (abs(left).bit_length() - 1) * right > CALCULATOR_MAX_BITS:
+                raise ValueError("Result is too large")
+            if isinstance(node.op, ast.Mult) and left.bit_length() + right.bit_length() > CALCULATOR_MAX_BITS + 1:
+                raise ValueError("Result is too large")
+        return check_result_size(CALCULATOR_OPERATORS[type(node.op)](left, right))
+    if isinstance(node, ast.UnaryOp) and type(node.op) in CALCULATOR_OPERATORS:
+        return CALCULATOR_OPERATORS[type(node.op)](evaluate_expression(node.operand))
+    raise ValueError("Only numbers and + - * / // % ** are supported")
+
+def check_result_size(value):
+    if isinstance(value, int) and value.bit_length() > CALCULATOR_MAX_BITS:
+        raise ValueError("Result is too large")
+    if isinstance(value, float) and not math.isfinite(value):
+        raise ValueError("Result is too large")
+    if isinstance(value, complex):
+        raise ValueError("Result is not a real number")
+    return value
+
+def calculate(parameters):
+    expression = parameters["expression"]
+    try:
+        value = evaluate_expression(ast.parse(expression, mode="eval"))
+    except (SyntaxError, ValueError, ZeroDivisionError) as e:
+        return {"success": False, "error": f"Invalid expression: {str(e)}"}
+    except OverflowError:
+        return {"success": False, "error": "Invalid expression: Result is too large"}
+    except (RecursionError, MemoryError):
+        return {"success": False, "error": "Invalid expression: Expression is nested too deeply"}
+    return {"success": True, "expression": expression, "result": value}
 
 # Demo functions for testing
 def initialize_demo_functions():
     # Weather function
-    functions["get_weather"] = {
-        "name": "get_weather",
-        "description": "Get the current weather for a location",
-        "parameters": {
+    functions.register(
+        "get_weather",
+        "Get the current weather for a location",
+        {
             "type": "object",
             "properties": {
                 "location": {
@@ -221,14 +370,15 @@ def initialize_demo_functions():
                 }
             },
             "required": ["location"]
-        }
-    }
+        },
+        get_weather
+    )
     
     # Calculator function
-    functions["calculate"] = {
-        "name": "calculate",
-        "description": "Perform a mathematical calculation",
-        "parameters": {
+    functions.register(
+        "calculate",
+        "Perform a mathematical calculation",
+        {
             "type": "object",
             "properties": {
                 "expression": {
@@ -237,11 +387,13 @@ def initialize_demo_functions():
                 }
             },
             "required": ["expression"]
-        }
-    }
+        },
+        calculate
+    )
 
 if __name__ == "__main__":
     # Initialize demo functions
     initialize_demo_functions()
     
-    app.run(debug=True, host="0.0.0.0", port=5000)
+    # Pass --production to serve with gunicorn worker processes
+    run(app, on_worker_exit=lambda: function_executor.shutdown(wait=True))
@@ -0,0 +1,85 @@
+from collections import OrderedDict, deque
+import threading
+
+SUMMARY_HIGHLIGHT_CHARS = 120
+
+
+class ConversationContext:
+    """Rolling window of recent messages plus a summary of everything older
+
+    Appending a message is O(1): once the window is full, the oldest
+    message is folded into the summary instead of being kept.
+    """
+
+    def __init__(self, window_size, summary_highlights):
+        self.lock = threading.Lock()
+        self.window = deque()
+        self.window_size = window_size
+        self.last = None  # (created_at, id) of the newest message appended
+        self.summarized_count = 0
+        self.summarized_by_role = {}
+        self.highlights = deque(maxlen=summary_highlights)
+
+    def append(self, message):
+        self.window.append(message)
+        self.last = (message["created_at"], message["id"])
+        if len(self.window) > self.window_size:
+            self._summarize(self.window.popleft())
+
+    def _summarize(self, message):
+        role = message["role"]
+        self.summarized_count += 1
+        self.summarized_by_role[role] = self.summarized_by_role.get(role, 0) + 1
+        if role == "user" and isinstance(message["content"], str):
+            self.highlights.append(message["content"][:SUMMARY_HIGHLIGHT_CHARS])
+
+    def summary(self):
+        if not self.summarized_count:
+            return ""
+        roles = ", ".join(f"{count} {role}" for role, count in self.summarized_by_role.items())
+        summary = f"{self.summarized_count} earlier messages ({roles})."
+        if self.highlights:
+            summary += " Earlier user requests: " + " | ".join(self.highlights)
+        return summary
+
+
+class ContextWindows:
+    """Per-conversation context windows kept up to date with storage
+
+    A conversation's window is built from storage the first time it is
+    needed. After that each call only reads the messages stored after the
+    newest one in the window, whichever process stored them, so building
+    completion context costs the same at message ten and message ten
+    thousand and stays current when storage is shared. Only the most
+    recently used conversations are kept.
+    """
+
+    def __init__(self, storage, window_size=20, summary_highlights=10, max_conversations=10000):
+        self.storage = storage
+        self.window_size = window_size
+        self.summary_highlights = summary_highlights
+        self.max_conversations = max_conversations
+        self._lock = threading.Lock()
+        self._contexts = OrderedDict()
+
+    def _refresh(self, conversation_id):
+        with self._lock:
+            context = self._contexts.get(conversation_id)
+            if context is None:
+                context = self._contexts[conversation_id] = ConversationContext(self.window_size,
+                                                                                self.summary_highlights)
+                if len(self._contexts) > self.max_conversations:
+                    self._contexts.popitem(last=False)
+            else:
+                self._contexts.move_to_end(conversation_id)
+        # Storage is read under the conversation's own lock, so other conversations are not held up
+        with context.lock:
+            for message in self.storage.list_messages(conversation_id, None, context.last):
+                context.append(message)
+        return context
+
+    def get(self, conversation_id):
+        """Return {"summary", "messages"}: the summary of older messages and the window, oldest first"""
+        context = self._refresh(conversation_id)
+        with context.lock:
+            return {"summary": context.summary(), "messages": list(context.window)}
@@ -0,0 +1,564 @@
+from array import array
+from collections import defaultdict
+import heapq
+import json
+import logging
+import mmap
+import os
+import re
+import struct
+import sys
+import threading
+import uuid
+
+from mcp_file_io import relative_file_name, walk_files
+
+TOKEN_PATTERN = re.compile(r"\w+")
+NGRAM_SIZE = 3
+MAX_LOCATIONS_PER_FILE = 50
+INDEX_FORMAT_VERSION = 3
+SEGMENT_MAGIC = b"MCPIDX03"
+SEGMENT_FOOTER = struct.Struct("<Q8s")
+SECTIONS = ("tokens", "ngrams")
+# Pending postings are written to a segment once they reach this many
+PENDING_FLUSH_POSTINGS = 500000
+# Above this many segments, the smallest MERGE_FACTOR are merged into one
+MAX_SEGMENTS = 8
+MERGE_FACTOR = 4
+
+# Locations in the file table besides a segment name
+_PENDING = None   # indexed in memory, not yet written to a segment
+_UNINDEXED = ""   # could not be read; skipped until it changes
+
+
+class FileSearchIndex:
+    """Persistent trigram and word index over the files in a directory and its subdirectories
+
+    Every file is indexed by its lowercased word tokens, for term queries,
+    and by its character trigrams, for substring queries. Postings only say
+    which files contain a term, so a query narrows the directory down to
+    the files containing every trigram (or word) of the query and only
+    those candidates are read to confirm matches and find their locations.
+
+    The index lives in a directory of immutable segment files, memory-mapped
+    rather than loaded, plus a manifest with the (mtime, size, inode)
+    signature and segment of every file. Newly indexed files are kept in
+    memory until save() writes them as a new segment, and reconcile() only
+    re-reads files whose signature changed on disk.
+    """
+
+    def __init__(self, directory, index_path, content_cache=None):
+        self.directory = directory
+        self.index_path = index_path
+        # Candidates are read through this ContentCache when given, so hot files are not decoded per query
+        self.content_cache = content_cache
+        self._lock = threading.RLock()
+        # Serializes segment writes, merges and manifest saves, which run outside _lock
+        self._save_lock = threading.Lock()
+        self._dirty = False
+        self._stop_reconcile = None
+        self._reset()
+
+    def _reset(self):
+        self._segments = {}       # segment name -> _Segment
+        self._files = {}          # filename -> ((mtime_ns, size, inode), segment name or _PENDING/_UNINDEXED)
+        self._pending = {}        # filename -> (tokens, ngrams) not yet written to a segment
+        self._pending_postings = 0
+        self._obsolete = []       # segment names to delete once the manifest no longer lists them
+
+    # Building and maintenance
+
+    def rebuild(self):
+        """Index every file in the directory from scratch"""
+        with self._lock:
+            obsolete = self._obsolete + list(self._segments)
+            self._reset()
+            self._obsolete = obsolete
+            self._dirty = True
+        self.reconcile()
+
+    def reconcile(self):
+        """Bring the index up to date with the directory using only stat calls
+
+        Files whose (mtime, size, inode) signature is unchanged are skipped,
+        so the cost scales with the number of changed files rather than the
+        size of the directory. Returns (reindexed, removed) counts.
+        """
+        seen = set()
+        changed = []
+        for filename, entry in walk_files(self.directory):
+            seen.add(filename)
+            current = self._files.get(filename)
+            if current is None or current[0] != _signature(entry.stat()):
+                changed.append(filename)
+
+        reindexed = 0
+        for filename in changed:
+            if self.index_file(filename):
+                reindexed += 1
+            if self._pending_postings >= PENDING_FLUSH_POSTINGS:
+                with self._save_lock:
+                    self._flush()
+        removed = [filename for filename in list(self._files) if filename not in seen]
+        for filename in removed:
+            self.remove_file(filename)
+
+        if changed or removed:
+            logging.info("Reconciled search index: %s reindexed, %s removed", reindexed, len(removed))
+        return reindexed, len(removed)
+
+    def start_auto_reconcile(self, interval):
+        """Reconcile and save the index every interval seconds on a daemon thread"""
+        if self._stop_reconcile is not None:
+            return
+        self._stop_reconcile = threading.Event()
+
+        def run(stop):
+            while not stop.wait(interval):
+                try:
+                    self.reconcile()
+                    self.save()
+                except Exception as e:
+                    logging.error("Error reconciling search index: %s", e)
+
+        threading.Thread(target=run, args=(self._stop_reconcile,),
+                         name="search-index-reconcile", daemon=True).start()
+
+    def stop_auto_reconcile(self):
+        if self._stop_reconcile is not None:
+            self._stop_reconcile.set()
+            self._stop_reconcile = None
+
+    def index_file(self, filename):
+        """(Re)index a single file, replacing any previous postings for it
+
+        filename is relative to the directory and may name a file in a
+        subdirectory; it is stored in the "/" separated form reconcile uses.
+        """
+        filename = relative_file_name(filename)
+        if filename is None:
+            return False
+        file_path = os.path.join(self.directory, filename)
+        signature = None
+        try:
+            # Stat before reading so a concurrent change is picked up by the next reconcile
+            signature = _signature(os.stat(file_path))
+            with open(file_path, 'r', encoding='utf-8') as file:
+                content = file.read().lower()
+        except Exception as e:
+            logging.error("Error indexing file %s: %s", filename, e)
+            self.remove_file(filename)
+            if signature is not None:
+                # Remember unreadable files so reconcile does not retry them until they change
+                with self._lock:
+                    self._files[filename] = (signature, _UNINDEXED)
+            return False
+
+        terms = (set(TOKEN_PATTERN.findall(content)), _ngrams(content))
+        with self._lock:
+            self._drop_pending(filename)
+            self._pending[filename] = terms
+            self._pending_postings += len(terms[0]) + len(terms[1])
+            self._files[filename] = (signature, _PENDING)
+            self._dirty = True
+        return True
+
+    def remove_file(self, filename):
+        filename = relative_file_name(filename)
+        with self._lock:
+            self._drop_pending(filename)
+            if self._files.pop(filename, None) is not None:
+                self._dirty = True
+
+    def _drop_pending(self, filename):
+        terms = self._pending.pop(filename, None)
+        if terms is not None:
+            self._pending_postings -= len(terms[0]) + len(terms[1])
+
+    def _live(self, filename, segment_name):
+        entry = self._files.get(filename)
+        return entry is not None and entry[1] == segment_name
+
+    # Persistence
+
+    def load(self):
+        """Open a previously saved index, returning False if there is none
+
+        Only the manifest is read; segments are memory-mapped, so startup
+        time does not depend on how much text is indexed.
+        """
+        if os.path.isfile(self.index_path):
+            # A single-file index from an older version; it is replaced on the next save
+            return False
+        try:
+            with open(os.path.join(self.index_path, "manifest.json"), 'r', encoding='utf-8') as file:
+                manifest = json.load(file)
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            logging.error("Error loading search index %s: %s", self.index_path, e)
+            return False
+
+        if manifest.get("version") != INDEX_FORMAT_VERSION:
+            return False
+
+        segments = {}
+        for name in manifest["segments"]:
+            try:
+                segments[name] = _Segment(os.path.join(self.index_path, name))
+            except Exception as e:
+                logging.error("Error opening search index segment %s: %s", name, e)
+        files = {}
+        for filename, (mtime_ns, size, inode, location) in manifest["files"].items():
+            # Files in a missing segment are left out, so the next reconcile reindexes them
+            if location == _UNINDEXED or location in segments:
+                files[filename] = ((mtime_ns, size, inode), location)
+
+        with self._lock:
+            self._reset()
+            self._segments = segments
+            self._files = files
+            self._dirty = False
+        # Segments not in the manifest were left behind by a crash or an interrupted merge
+        for name in os.listdir(self.index_path):
+            if name.endswith(".seg") and name not in segments:
+                _remove(os.path.join(self.index_path, name))
+        logging.info("Loaded search index for %s files from %s", len(files), self.index_path)
+        return True
+
+    def save(self):
+        """Write pending files to a new segment and save the manifest if anything changed
+
+        Segments and the manifest are written outside the index lock, from
+        a copy of the file table, so searches and writes are not blocked
+        while the index is saved.
+        """
+        with self._save_lock:
+            self._flush()
+            with self._lock:
+                if not self._dirty:
+                    return
+                files = {filename: [*signature, location]
+                         for filename, (signature, location) in self._files.items() if location is not _PENDING}
+                segments = list(self._segments)
+                obsolete, self._obsolete = self._obsolete, []
+                self._dirty = False
+
+            manifest = {"version": INDEX_FORMAT_VERSION, "segments": segments, "files": files}
+            # Per-process temp file so several workers can save without clobbering each other
+            temp_path = os.path.join(self._index_directory(), f"manifest.json.{os.getpid()}.tmp")
+            with open(temp_path, 'w', encoding='utf-8') as file:
+                json.dump(manifest, file, separators=(",", ":"))
+            os.replace(temp_path, os.path.join(self.index_path, "manifest.json"))
+            for name in obsolete:
+                _remove(os.path.join(self.index_path, name))
+
+    def _index_directory(self):
+        if os.path.isfile(self.index_path):
+            os.remove(self.index_path)
+        os.makedirs(self.index_path, exist_ok=True)
+        return self.index_path
+
+    def _new_segment_path(self):
+        return os.path.join(self._index_directory(), f"{uuid.uuid4().hex}.seg")
+
+    def _flush(self):
+        """Write the pending files to a new segment, then merge segments if there are too many
+
+        Called with _save_lock held.
+        """
+        with self._lock:
+            pending = dict(self._pending)
+            signatures = {filename: self._files[filename][0] for filename in pending}
+        if pending:
+            path = self._new_segment_path()
+            _write_segment(path, *_postings(pending, signatures))
+            segment = _Segment(path)
+            with self._lock:
+                self._segments[segment.name] = segment
+                for filename, terms in pending.items():
+                    # Files reindexed or removed meanwhile stay pending, or are dead in the segment
+                    if self._pending.get(filename) is terms:
+                        self._drop_pending(filename)
+                        self._files[filename] = (signatures[filename], segment.name)
+                self._dirty = True
+        self._merge()
+
+    def _merge(self):
+        with self._lock:
+            live = {name: [self._live(filename, name) for filename in segment.files]
+                    for name, segment in self._segments.items()}
+            # Segments without a live file are dropped without merging
+            empty = [name for name, flags in live.items() if not any(flags)]
+            for name in empty:
+                del self._segments[name]
+            self._obsolete.extend(empty)
+            self._dirty = self._dirty or bool(empty)
+            if len(self._segments) <= MAX_SEGMENTS:
+                return
+            sources = sorted(self._segments.values(), key=lambda segment: segment.size)[:MERGE_FACTOR]
+
+        path = self._new_segment_path()
+        _write_segment(path, *_merged_postings(sources, [live[segment.name] for segment in sources]))
+        merged = _Segment(path)
+        names = {segment.name for segment in sources}
+        with self._lock:
+            for filename in merged.files:
+                entry = self._files.get(filename)
+                if entry is not None and entry[1] in names:
+                    self._files[filename] = (entry[0], merged.name)
+            for name in names:
+                del self._segments[name]
+            self._segments[merged.name] = merged
+            self._obsolete.extend(names)
+            self._dirty = True
+
+    # Queries
+
+    def search(self, query, match="substring"):
+        """Return files matching the query, most matches first
+
+        match="substring" finds the query anywhere in the text, like the
+        original case-insensitive substring search. match="term" only
+        counts whole words and requires every word of the query.
+        """
+        query = query.lower()
+        if match == "term":
+            terms = set(TOKEN_PATTERN.findall(query))
+            if not terms:
+                return []
+            candidates = self._candidates("tokens", terms)
+        else:
+            if not query:
+                return []
+            terms = None
+            candidates = self._candidates("ngrams", _ngrams(query))
+
+        results = []
+        for filename in candidates:
+            try:
+                content = self._read(os.path.join(self.directory, filename)).lower()
+            except (OSError, UnicodeDecodeError):
+                continue
+            if terms is not None:
+                offsets = [found.start() for found in TOKEN_PATTERN.finditer(content) if found.group() in terms]
+                matches = len(offsets)
+            else:
+                matches = content.count(query)
+                offsets = _find_all(content, query, MAX_LOCATIONS_PER_FILE)
+            if matches:
+                results.append({
+                    "filename": filename,
+                    "matches": matches,
+                    "locations": _locations(content, offsets[:MAX_LOCATIONS_PER_FILE])
+                })
+
+        results.sort(key=lambda result: (-result["matches"], result["filename"]))
+        return results
+
+    def _read(self, file_path):
+        if self.content_cache is not None:
+            return self.content_cache.read(file_path, os.stat(file_path))
+        with open(file_path, 'r', encoding='utf-8') as file:
+            return file.read()
+
+    def _candidates(self, section, terms):
+        """Filenames of the indexed files containing every term, or every file when there are no terms"""
+        with self._lock:
+            if not terms:
+                return [filename for filename, (_, location) in self._files.items() if location != _UNINDEXED]
+            keys = [term.encode("utf-8") for term in terms]
+            candidates = []
+            for name, segment in self._segments.items():
+                postings = [segment.lookup(section, key) for key in keys]
+                if any(ids is None for ids in postings):
+                    continue
+                postings.sort(key=len)
+                ids = set(postings[0])
+                for other in postings[1:]:
+                    ids.intersection_update(other)
+                    if not ids:
+                        break
+                candidates.extend(segment.files[doc] for doc in ids if self._live(segment.files[doc], name))
+            index = SECTIONS.index(section)
+            candidates.extend(filename for filename, pending in self._pending.items()
+                              if terms <= pending[index])
+        return candidates
+
+
+class _Segment:
+    """Read-only view of a memory-mapped segment file
+
+    A segment holds a list of files and, per section (tokens and ngrams),
+    the sorted terms with the ids of the files containing each one:
+
+        postings | term offsets | posting offsets | term bytes   (per section)
+        footer JSON | footer length and magic
+
+    Offsets and file ids are native uint32 arrays, read in place.
+    """
+
+    def __init__(self, path):
+        self.name = os.path.basename(path)
+        with open(path, 'rb') as file:
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.size = len(self._map)
+        length, magic = SEGMENT_FOOTER.unpack(self._map[-SEGMENT_FOOTER.size:])
+        if magic != SEGMENT_MAGIC:
+            raise ValueError(f"Not a search index segment: {path}")
+        footer = json.loads(self._map[-SEGMENT_FOOTER.size - length:-SEGMENT_FOOTER.size])
+        if footer["version"] != INDEX_FORMAT_VERSION or footer["byteorder"] != sys.byteorder:
+            raise ValueError(f"Unsupported search index segment: {path}")
+        self.files = [entry[0] for entry in footer["files"]]
+        self.signatures = [tuple(entry[1:]) for entry in footer["files"]]
+
+        view = memoryview(self._map)
+        self._sections = {}
+        for section in SECTIONS:
+            info = footer[section]
+            count = info["count"]
+            term_offsets = view[info["term_offsets"]:info["term_offsets"] + 4 * (count + 1)].cast("I")
+            posting_offsets = view[info["posting_offsets"]:info["posting_offsets"] + 4 * (count + 1)].cast("I")
+            postings = view[info["postings"]:info["postings"] + 4 * posting_offsets[count]].cast("I")
+            self._sections[section] = (count, term_offsets, posting_offsets, info["terms"], postings)
+
+    def term(self, section, index):
+        _, term_offsets, _, terms, _ = self._sections[section]
+        return self._map[terms + term_offsets[index]:terms + term_offsets[index + 1]]
+
+    def postings(self, section, index):
+        _, _, posting_offsets, _, postings = self._sections[section]
+        return postings[posting_offsets[index]:posting_offsets[index + 1]]
+
+    def lookup(self, section, key):
+        """Return the file ids for a UTF-8 encoded term, or None if no file contains it"""
+        low, high = 0, self._sections[section][0]
+        while low < high:
+            middle = (low + high) // 2
+            if self.term(section, middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self._sections[section][0] and self.term(section, low) == key:
+            return self.postings(section, low)
+        return None
+
+    def items(self, section):
+        for index in range(self._sections[section][0]):
+            yield self.term(section, index), self.postings(section, index)
+
+
+def _write_segment(path, files, sections):
+    """Write a segment from [filename, mtime_ns, size, inode] entries and sorted (term, ids) per section"""
+    footer = {"version": INDEX_FORMAT_VERSION, "byteorder": sys.byteorder, "files": files}
+    with open(path, 'wb') as out:
+        for section in SECTIONS:
+            term_offsets = array("I", [0])
+            posting_offsets = array("I", [0])
+            terms = bytearray()
+            info = {"postings": out.tell()}
+            for term, ids in sections[section]:
+                terms += term
+                term_offsets.append(len(terms))
+                ids.tofile(out)
+                posting_offsets.append(posting_offsets[-1] + len(ids))
+            info["count"] = len(term_offsets) - 1
+            info["term_offsets"] = out.tell()
+            term_offsets.tofile(out)
+            info["posting_offsets"] = out.tell()
+            posting_offsets.tofile(out)
+            info["terms"] = out.tell()
+            # Pad so the next section's arrays stay 4-byte aligned
+            out.write(bytes(terms) + b"\0" * (-len(terms) % 4))
+            footer[section] = info
+        data = json.dumps(footer, separators=(",", ":")).encode("utf-8")
+        out.write(data)
+        out.write(SEGMENT_FOOTER.pack(len(data), SEGMENT_MAGIC))
+        out.flush()
+        os.fsync(out.fileno())
+
+
+def _postings(pending, signatures):
+    """Segment contents for pending files: the file list and sorted (term, ids) per section"""
+    files = []
+    sections = (defaultdict(list), defaultdict(list))
+    for doc, (filename, terms) in enumerate(pending.items()):
+        files.append([filename, *signatures[filename]])
+        for postings, section_terms in zip(sections, terms):
+            for term in section_terms:
+                postings[term].append(doc)
+    return files, {
+        section: sorted((term.encode("utf-8"), array("I", ids)) for term, ids in postings.items())
+        for section, postings in zip(SECTIONS, sections)
+    }
+
+
+def _merged_postings(segments, live):
+    """Segment contents combining the live files of several segments"""
+    files = []
+    remaps = []
+    for segment, flags in zip(segments, live):
+        remap = array("l", [-1]) * len(segment.files)
+        for doc, is_live in enumerate(flags):
+            if is_live:
+                remap[doc] = len(files)
+                files.append([segment.files[doc], *segment.signatures[doc]])
+        remaps.append(remap)
+
+    def stream(segment, remap, section):
+        for term, ids in segment.items(section):
+            yield term, ids, remap
+
+    def merge(section):
+        # Each segment's terms are sorted, so they can be merged in one lazy pass
+        current = None
+        merged = array("I")
+        streams = [stream(segment, remap, section) for segment, remap in zip(segments, remaps)]
+        for term, ids, remap in heapq.merge(*streams, key=lambda item: item[0]):
+            if term != current:
+                if merged:
+                    yield current, merged
+                current = term
+                merged = array("I")
+            merged.extend(doc for doc in (remap[old] for old in ids) if doc >= 0)
+        if merged:
+            yield current, merged
+
+    return files, {section: merge(section) for section in SECTIONS}
+
+
+def _signature(stat_result):
+    return (stat_result.st_mtime_ns, stat_result.st_size, stat_result.st_ino)
+
+
+def _ngrams(text):
+    # zip and map keep the per-character work in C
+    return set(map("".join, zip(*(text[shift:] for shift in range(NGRAM_SIZE)))))
+
+
+def _find_all(content, query, limit):
+    """Offsets of the first limit non-overlapping matches, the way str.count counts them"""
+    offsets = []
+    offset = content.find(query)
+    while offset != -1 and len(offsets) < limit:
+        offsets.append(offset)
+        offset = content.find(query, offset + len(query))
+    return offsets
+
+
+def _locations(content, offsets):
+    locations = []
+    line = 1
+    previous = 0
+    for offset in offsets:
+        line += content.count("\n", previous, offset)
+        previous = offset
+        locations.append({"line": line, "column": offset - (content.rfind("\n", 0, offset) + 1) + 1})
+    return locations
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,809 @@
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict
+from datetime import datetime
+import contextlib
+import fnmatch
+import hashlib
+import json
+import logging
+import mmap
+import os
+import shutil
+import stat
+import struct
+import tempfile
+import threading
+import time
+import uuid
+
+try:
+    import fcntl
+except ImportError:  # Windows: writes are only serialized within a process
+    fcntl = None
+
+# Sidecar layout: mtime_ns, size, inode, line count, then one start offset per line
+LINE_INDEX_HEADER = struct.Struct("=QQQQ")
+LINE_OFFSET = struct.Struct("=Q")
+
+
+def _is_continuation_byte(byte):
+    return byte & 0xC0 == 0x80
+
+
+def _align_start(mapped, offset, end):
+    """Move offset forward past UTF-8 continuation bytes"""
+    while offset < end and _is_continuation_byte(mapped[offset]):
+        offset += 1
+    return offset
+
+
+def _align_end(mapped, start, end, size):
+    """Move end back so the range does not stop in the middle of a character"""
+    while end > start and end < size and _is_continuation_byte(mapped[end]):
+        end -= 1
+    return end
+
+
+def read_bytes(file_path, start, end, size):
+    """Decode the bytes [start, end) of a file through a memory map
+
+    Only the requested pages are touched. Byte ranges that split a UTF-8
+    character are narrowed to whole characters, and the actual range read
+    is returned along with the text.
+    """
+    end = min(end, size)
+    if start >= end:
+        return "", start, start
+    with open(file_path, 'rb') as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            start = _align_start(mapped, start, end)
+            end = _align_end(mapped, start, end, size)
+            return mapped[start:end].decode('utf-8'), start, end
+
+
+class LineOffsetIndex:
+    """Sidecar files of line start offsets used to seek straight to a line
+
+    A sidecar is built once per file version (checked against mtime, size
+    and inode) and then memory-mapped, so locating any line is a single
+    fixed-size read no matter how large the file is.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+    def _sidecar_path(self, file_path):
+        # Named by a hash of the file's absolute path, so nested and odd names stay flat inside directory
+        name = hashlib.sha1(os.path.abspath(file_path).encode("utf-8")).hexdigest() + ".lines"
+        return os.path.join(self.directory, name)
+
+    def line_range(self, file_path, filename, start_line, end_line, stat_result):
+        """Return (byte_start, byte_end, total_lines) for 1-based inclusive lines"""
+        sidecar_path = self._sidecar_path(file_path)
+        signature = (stat_result.st_mtime_ns, stat_result.st_size, stat_result.st_ino)
+        for attempt in range(2):
+            try:
+                with open(sidecar_path, 'rb') as sidecar:
+                    with mmap.mmap(sidecar.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                        mtime_ns, size, inode, total_lines = LINE_INDEX_HEADER.unpack_from(mapped, 0)
+                        if (mtime_ns, size, inode) == signature:
+                            return self._lookup(mapped, start_line, end_line, total_lines, size)
+            except (FileNotFoundError, ValueError, struct.error):
+                pass
+            if attempt == 0:
+                self._build(file_path, sidecar_path, signature)
+        raise OSError(f"Could not build line index for {filename}")
+
+    @staticmethod
+    def _lookup(mapped, start_line, end_line, total_lines, size):
+        def line_start(line):
+            if line > total_lines:
+                return size
+            return LINE_OFFSET.unpack_from(mapped, LINE_INDEX_HEADER.size + (line - 1) * LINE_OFFSET.size)[0]
+
+        return line_start(start_line), line_start(end_line + 1), total_lines
+
+    def _build(self, file_path, sidecar_path, signature):
+        offsets = array('Q')
+        size = signature[1]
+        if size:
+            offsets.append(0)
+            with open(file_path, 'rb') as file:
+                with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    position = mapped.find(b"\n")
+                    while position != -1 and position + 1 < size:
+                        offsets.append(position + 1)
+                        position = mapped.find(b"\n", position + 1)
+
+        # A unique temporary file per build, since threads and processes may build the same sidecar at once
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(sidecar_path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'wb') as sidecar:
+                sidecar.write(LINE_INDEX_HEADER.pack(*signature, len(offsets)))
+                offsets.tofile(sidecar)
+            os.replace(temp_path, sidecar_path)
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.remove(temp_path)
+            raise
+        logging.info("Built line index for %s (%s lines)", file_path, len(offsets))
+
+
+class ContentCache:
+    """LRU cache of decoded file contents bounded by a byte budget
+
+    Entries are keyed by path and validated against the file's mtime and
+    size, so a changed file is never served stale even if nobody called
+    invalidate(). Files larger than the whole budget are not cached.
+
+    Passing a content hash as key shares one entry between every file with
+    that content.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # file_path or hash -> (signature, content, size)
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def read(self, file_path, stat_result, key=None):
+        """Return the decoded content of a file, from cache when it is unchanged"""
+        key = key or file_path
+        signature = (stat_result.st_mtime_ns, stat_result.st_size) if key == file_path else None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == signature:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        with open(file_path, 'r', encoding='utf-8') as file:
+            content = file.read()
+        self._put(key, signature, content, stat_result.st_size)
+        return content
+
+    def _put(self, key, signature, content, size):
+        with self._lock:
+            self._discard(key)
+            if size > self.max_bytes:
+                return
+            self._entries[key] = (signature, content, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, _, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def invalidate(self, file_path):
+        with self._lock:
+            self._discard(file_path)
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[2]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions
+            }
+
+
+def walk_files(root):
+    """Yield (relative path, os.DirEntry) for every file under root, with "/" separated paths
+
+    Symlinked directories are not followed, matching DirectoryCache.
+    """
+    pending = [""]
+    while pending:
+        relative_dir = pending.pop()
+        with os.scandir(os.path.join(root, relative_dir) if relative_dir else root) as entries:
+            for entry in entries:
+                relative_path = f"{relative_dir}/{entry.name}" if relative_dir else entry.name
+                if entry.is_file():
+                    yield relative_path, entry
+                elif entry.is_dir(follow_symlinks=False):
+                    pending.append(relative_path)
+
+
+def relative_file_name(filename):
+    """Normalize a file name to the "/" separated form walk_files yields, or None if it leaves the root"""
+    name = os.path.normpath(filename).replace(os.sep, "/")
+    if os.path.isabs(name) or name == ".." or name.startswith("../"):
+        return None
+    return name
+
+
+class DirectoryCache:
+    """Directory listings built with os.scandir and cached per directory
+
+    A cached listing is reused while the directory's mtime is unchanged
+    (entries added, removed or renamed change it) and it is younger than
+    max_age seconds, which bounds how long an out-of-band in-place edit can
+    show a stale size. Listing a tree therefore costs one stat per
+    directory instead of one per file. Writers should call invalidate().
+    """
+
+    def __init__(self, root, max_age=30, max_directories=10000):
+        self.root = root
+        self.max_age = max_age
+        self.max_directories = max_directories
+        self._lock = threading.Lock()
+        self._listings = OrderedDict()  # relative dir -> (mtime_ns, scanned_at, files, subdirs)
+
+    def _scan(self, relative_dir):
+        path = os.path.join(self.root, relative_dir) if relative_dir else self.root
+        mtime_ns = os.stat(path).st_mtime_ns
+        now = time.monotonic()
+        with self._lock:
+            cached = self._listings.get(relative_dir)
+            if cached is not None and cached[0] == mtime_ns and now - cached[1] < self.max_age:
+                self._listings.move_to_end(relative_dir)
+                return cached[2], cached[3]
+
+        files = []
+        subdirs = []
+        with os.scandir(path) as entries:
+            for entry in entries:
+                # The entry's cached file type avoids a stat just to tell files from directories
+                if entry.is_file():
+                    stat_result = entry.stat()
+                    files.append((entry.name, stat_result.st_size, stat_result.st_mtime))
+                elif entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.name)
+        files.sort()
+        subdirs.sort()
+
+        with self._lock:
+            self._listings[relative_dir] = (mtime_ns, now, files, subdirs)
+            self._listings.move_to_end(relative_dir)
+            if len(self._listings) > self.max_directories:
+                self._listings.popitem(last=False)
+        return files, subdirs
+
+    def invalidate(self, relative_dir=""):
+        with self._lock:
+            self._listings.pop(relative_dir, None)
+
+    def list(self, recursive=False, pattern=None, extensions=None, limit=None, cursor=None):
+        """Return (entries, total, next_cursor) for files under the root, sorted by path
+
+        pattern is a glob matched against the file name, or against the
+        relative path when it contains a "/". extensions is a list such as
+        [".txt", ".md"]. cursor is the last path of the previous page.
+        """
+        if extensions:
+            extensions = tuple(extension.lower() for extension in extensions)
+        match_path = pattern is not None and "/" in pattern
+
+        entries = []
+        pending = [""]
+        while pending:
+            relative_dir = pending.pop()
+            files, subdirs = self._scan(relative_dir)
+            for name, size, mtime in files:
+                relative_path = f"{relative_dir}/{name}" if relative_dir else name
+                if extensions and not name.lower().endswith(extensions):
+                    continue
+                if pattern is not None and not fnmatch.fnmatch(relative_path if match_path else name, pattern):
+                    continue
+                entries.append((relative_path, size, mtime))
+            if recursive:
+                pending.extend(f"{relative_dir}/{subdir}" if relative_dir else subdir for subdir in subdirs)
+        entries.sort()
+
+        start = bisect_right(entries, (cursor, float("inf"))) if cursor else 0
+        page = entries[start:start + limit] if limit else entries[start:]
+        next_cursor = None
+        if limit and start + limit < len(entries):
+            next_cursor = page[-1][0]
+        return [
+            {"name": path, "size": size, "modified": datetime.fromtimestamp(mtime).isoformat()}
+            for path, size, mtime in page
+        ], len(entries), next_cursor
+
+
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+
+# New files get the usual mode for the process umask (mkstemp would create them 0600)
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+DEFAULT_FILE_MODE = 0o666 & ~_UMASK
+
+
+def _fsync_directory(path):
+    """Make a rename in this directory durable (not supported on Windows)"""
+    if not hasattr(os, "O_DIRECTORY"):
+        return
+    fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _remove_if_exists(path):
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(path)
+
+
+def _match_mode(fd, file_path):
+    """Give a file about to replace file_path the same permissions (not supported on Windows)"""
+    if not hasattr(os, "fchmod"):
+        return
+    try:
+        mode = stat.S_IMODE(os.stat(file_path).st_mode)
+    except FileNotFoundError:
+        mode = DEFAULT_FILE_MODE
+    os.fchmod(fd, mode)
+
+
+class FileWriter:
+    """Durable writes into a directory, serialized per path
+
+    Whole-file writes go to a temporary file in staging_directory, are
+    fsynced and then renamed over the target, so readers and a crash only
+    ever see the old or the new content; the target keeps its permissions.
+    Appends and byte-range patches modify the file in place under the same
+    per-path lock. The lock is a thread lock plus an flock on a lock file in
+    staging_directory/locks, so writes from other worker processes wait too.
+    cleanup() removes lock files that have not been used for a while.
+    staging_directory must be on the same filesystem as directory for the
+    rename to be atomic.
+
+    Chunked uploads are staged as <upload_id>.part files and moved into
+    place by complete_upload(); their state lives on disk, so every worker
+    process can accept chunks for any upload.
+
+    With a BlobStore, finished files are stored as blobs and linked into
+    place, and appends and patches copy the file instead of changing a blob
+    other names may share.
+    """
+
+    def __init__(self, directory, staging_directory, blobs=None):
+        self.directory = directory
+        self.staging_directory = staging_directory
+        self.blobs = blobs
+        self.lock_directory = os.path.join(staging_directory, "locks")
+        os.makedirs(self.lock_directory, exist_ok=True)
+        self._locks_lock = threading.Lock()
+        self._locks = {}  # file_path -> [lock, users]
+        self._stop_cleanup = None
+
+    def _lock(self, file_path):
+        with self._locks_lock:
+            entry = self._locks.setdefault(file_path, [threading.Lock(), 0])
+            entry[1] += 1
+        return entry
+
+    def _unlock(self, file_path, entry):
+        entry[0].release()
+        with self._locks_lock:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[file_path]
+
+    def _locked(self, file_path, operation, remove_lock=None):
+        entry = self._lock(file_path)
+        entry[0].acquire()
+        try:
+            with self._process_lock(file_path, remove_lock):
+                return operation()
+        finally:
+            self._unlock(file_path, entry)
+
+    def _lock_path(self, file_path):
+        name = hashlib.sha1(os.path.abspath(file_path).encode("utf-8")).hexdigest() + ".lock"
+        return os.path.join(self.lock_directory, name)
+
+    @contextlib.contextmanager
+    def _process_lock(self, file_path, remove_lock=None):
+        """Hold an flock on file_path's lock file; it is removed on release if remove_lock() is true"""
+        if fcntl is None:
+            yield
+            return
+        lock_path = self._lock_path(file_path)
+        while True:
+            fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o666)
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            # A lock file is only removed by a process holding it, so one still at lock_path is current;
+            # otherwise it was removed while we waited and the new one has to be locked instead
+            with contextlib.suppress(FileNotFoundError):
+                if os.stat(lock_path).st_ino == os.fstat(fd).st_ino:
+                    break
+            os.close(fd)
+        try:
+            yield
+        finally:
+            if remove_lock is not None and remove_lock():
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(lock_path)
+            os.close(fd)  # releases the flock
+
+    def write(self, filename, content):
+        """Replace a file's content atomically; returns the new size in bytes"""
+        data = content.encode("utf-8")
+        return self._replace(filename, lambda file: file.write(data))
+
+    def _replace(self, filename, fill):
+        file_path = os.path.join(self.directory, filename)
+
+        def replace():
+            fd, temp_path = tempfile.mkstemp(dir=self.staging_directory, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "w+b") as file:
+                    fill(file)
+                    file.flush()
+                    _match_mode(file.fileno(), file_path)
+                    os.fsync(file.fileno())
+                self._commit(temp_path, file_path)
+            except BaseException:
+                with contextlib.suppress(OSError):
+                    os.remove(temp_path)
+                raise
+            _fsync_directory(os.path.dirname(file_path) or ".")
+            return os.stat(file_path).st_size
+
+        return self._locked(file_path, replace)
+
+    def _commit(self, temp_path, file_path):
+        if self.blobs is not None:
+            self.blobs.link(temp_path, file_path)
+        else:
+            os.replace(temp_path, file_path)
+
+    @staticmethod
+    def _copy_existing(file_path, target):
+        with contextlib.suppress(FileNotFoundError):
+            with open(file_path, "rb") as source:
+                shutil.copyfileobj(source, target, UPLOAD_CHUNK_BYTES)
+
+    def append(self, filename, content):
+        """Append to a file, creating it if needed; returns the new size in bytes"""
+        data = content.encode("utf-8")
+        file_path = os.path.join(self.directory, filename)
+
+        def append():
+            with open(file_path, "ab") as file:
+                file.write(data)
+                file.flush()
+                os.fsync(file.fileno())
+                return file.tell()
+
+        if self.blobs is not None:
+            return self._replace(filename, lambda file: (self._copy_existing(file_path, file), file.write(data)))
+        return self._locked(file_path, append)
+
+    def patch(self, filename, offset, content):
+        """Overwrite bytes starting at offset, extending the file if needed; returns the new size
+
+        The patch must start and end on UTF-8 character boundaries so the
+        file stays valid text.
+        """
+        data = content.encode("utf-8")
+        file_path = os.path.join(self.directory, filename)
+
+        def patch():
+            with open(file_path, "r+b") as file:
+                size = self._patch(file, offset, data)
+                file.flush()
+                os.fsync(file.fileno())
+                return size
+
+        def patch_copy(file):
+            self._copy_existing(file_path, file)
+            self._patch(file, offset, data)
+
+        if not os.path.exists(file_path):
+            raise ValueError(f"File not found: {filename}")
+        if self.blobs is not None:
+            return self._replace(filename, patch_copy)
+        return self._locked(file_path, patch)
+
+    @staticmethod
+    def _patch(file, offset, data):
+        size = os.fstat(file.fileno()).st_size
+        if offset > size:
+            raise ValueError(f"offset {offset} is past the end of the file ({size} bytes)")
+        for position in (offset, offset + len(data)):
+            if position < size:
+                file.seek(position)
+                if _is_continuation_byte(file.read(1)[0]):
+                    raise ValueError(f"Byte {position} is inside a UTF-8 character")
+        file.seek(offset)
+        file.write(data)
+        return max(size, offset + len(data))
+
+    def _upload_paths(self, upload_id):
+        # Upload ids are generated by begin_upload(); anything else is rejected
+        # so an id can never point outside the staging directory.
+        if not upload_id or not all(char in "0123456789abcdef" for char in upload_id):
+            raise KeyError(upload_id)
+        base = os.path.join(self.staging_directory, upload_id)
+        if not os.path.exists(base + ".json"):
+            raise KeyError(upload_id)
+        return base + ".part", base + ".json"
+
+    def begin_upload(self, filename):
+        """Start a chunked upload of filename; returns the upload id"""
+        upload_id = uuid.uuid4().hex
+        base = os.path.join(self.staging_directory, upload_id)
+        open(base + ".part", "wb").close()
+        with open(base + ".json", "w", encoding="utf-8") as file:
+            json.dump({"filename": filename, "created_at": datetime.now().isoformat()}, file)
+        return upload_id
+
+    def upload_status(self, upload_id):
+        """Return {"upload_id", "filename", "received"}; raises KeyError for unknown uploads"""
+        part_path, meta_path = self._upload_paths(upload_id)
+        with open(meta_path, encoding="utf-8") as file:
+            meta = json.load(file)
+        return {"upload_id": upload_id, "filename": meta["filename"], "received": os.path.getsize(part_path)}
+
+    def write_chunk(self, upload_id, stream, offset):
+        """Copy a chunk from a file-like stream to the upload at offset; returns bytes received so far
+
+        offset must equal the bytes received so far, so a client that lost a
+        response can ask upload_status() and resume without duplicating data.
+        The chunk is copied UPLOAD_CHUNK_BYTES at a time and never held whole.
+        """
+        part_path, meta_path = self._upload_paths(upload_id)
+
+        def write():
+            if not os.path.exists(meta_path):
+                raise KeyError(upload_id)  # completed or aborted while waiting for the lock
+            with open(part_path, "ab") as file:
+                received = file.tell()
+                if offset != received:
+                    raise ValueError(f"offset must be {received}, the number of bytes received so far")
+                shutil.copyfileobj(stream, file, UPLOAD_CHUNK_BYTES)
+                return file.tell()
+
+        return self._locked(part_path, write, remove_lock=lambda: not os.path.exists(meta_path))
+
+    def complete_upload(self, upload_id):
+        """Move a finished upload into place atomically; returns (filename, size)"""
+        part_path, meta_path = self._upload_paths(upload_id)
+        with open(meta_path, encoding="utf-8") as file:
+            filename = json.load(file)["filename"]
+
+        file_path = os.path.join(self.directory, filename)
+
+        def complete():
+            os.remove(meta_path)  # later chunks for this upload are rejected
+            with open(part_path, "rb") as file:
+                _match_mode(file.fileno(), file_path)
+                os.fsync(file.fileno())
+                size = os.fstat(file.fileno()).st_size
+            self._locked(file_path, lambda: self._commit(part_path, file_path))
+            _fsync_directory(os.path.dirname(file_path) or ".")
+            return size
+
+        # Once the upload is gone its lock file is not needed again
+        return filename, self._locked(part_path, complete, remove_lock=lambda: not os.path.exists(meta_path))
+
+    def abort_upload(self, upload_id):
+        part_path, meta_path = self._upload_paths(upload_id)
+
+        def abort():
+            for path in (meta_path, part_path):
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(path)
+
+        self._locked(part_path, abort, remove_lock=lambda: True)
+
+    def cleanup(self, max_age):
+        """Remove uploads, temporary files and unused lock files untouched for max_age seconds
+
+        Returns the number of abandoned uploads removed.
+        """
+        cutoff = time.time() - max_age
+        aborted = 0
+        with os.scandir(self.staging_directory) as entries:
+            staged = [(entry.name, entry.stat().st_mtime) for entry in entries if entry.is_file()]
+        modified = dict(staged)
+        for name, mtime in staged:
+            upload_id, extension = os.path.splitext(name)
+            if extension == ".json":
+                # An upload is active while chunks keep arriving, which updates its .part file
+                if max(mtime, modified.get(upload_id + ".part", 0)) < cutoff:
+                    with contextlib.suppress(KeyError):
+                        self.abort_upload(upload_id)
+                        aborted += 1
+            elif extension in (".tmp", ".link") and mtime < cutoff:
+                # Left behind by a write interrupted by a crash
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(os.path.join(self.staging_directory, name))
+            elif extension == ".part" and upload_id + ".json" not in modified and mtime < cutoff:
+                part_path = os.path.join(self.staging_directory, name)
+                # Under the upload's lock, so a complete_upload still moving it into place finishes first
+                self._locked(part_path, lambda: _remove_if_exists(part_path), remove_lock=lambda: True)
+        if fcntl is not None:
+            with os.scandir(self.lock_directory) as entries:
+                stale = [entry.path for entry in entries if entry.stat().st_mtime < cutoff]
+            for lock_path in stale:
+                self._remove_unused_lock(lock_path)
+        if aborted:
+            logging.info("Removed %s abandoned uploads", aborted)
+        return aborted
+
+    @staticmethod
+    def _remove_unused_lock(lock_path):
+        try:
+            fd = os.open(lock_path, os.O_RDWR)
+        except FileNotFoundError:
+            return
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return
+        try:
+            # Held now, so removing it is safe (see _process_lock)
+            if os.stat(lock_path).st_ino == os.fstat(fd).st_ino:
+                os.remove(lock_path)
+        except FileNotFoundError:
+            pass
+        finally:
+            os.close(fd)
+
+    def start_auto_cleanup(self, interval, max_age):
+        """Run cleanup(max_age) every interval seconds on a daemon thread"""
+        if self._stop_cleanup is not None:
+            return
+        self._stop_cleanup = threading.Event()
+
+        def run(stop):
+            while not stop.wait(interval):
+                try:
+                    self.cleanup(max_age)
+                except Exception as e:
+                    logging.error("Error cleaning up staged uploads: %s", e)
+
+        threading.Thread(target=run, args=(self._stop_cleanup,), name="upload-cleanup", daemon=True).start()
+
+    def stop_auto_cleanup(self):
+        if self._stop_cleanup is not None:
+            self._stop_cleanup.set()
+            self._stop_cleanup = None
+
+
+class ContentHashes:
+    """SHA-256 digests of file contents, cached by inode and validated by mtime and size"""
+
+    def __init__(self, max_entries=100000):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._digests = OrderedDict()  # (st_dev, st_ino) -> (signature, digest)
+
+    def get(self, file_path, stat_result):
+        """Return the hex digest of a file's content, hashing it only when it changed"""
+        digest = self.cached(stat_result)
+        if digest is not None:
+            return digest
+        digest = hash_file(file_path)
+        # Only remembered if the file did not change while it was being hashed
+        if _signature(os.stat(file_path)) == _signature(stat_result):
+            self.remember(stat_result, digest)
+        return digest
+
+    def cached(self, stat_result):
+        key = (stat_result.st_dev, stat_result.st_ino)
+        with self._lock:
+            entry = self._digests.get(key)
+            if entry is not None and entry[0] == _signature(stat_result):
+                self._digests.move_to_end(key)
+                return entry[1]
+        return None
+
+    def remember(self, stat_result, digest):
+        with self._lock:
+            self._digests[(stat_result.st_dev, stat_result.st_ino)] = (_signature(stat_result), digest)
+            if len(self._digests) > self.max_entries:
+                self._digests.popitem(last=False)
+
+
+def _signature(stat_result):
+    return (stat_result.st_mtime_ns, stat_result.st_size)
+
+
+def hash_file(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        for chunk in iter(lambda: file.read(UPLOAD_CHUNK_BYTES), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class BlobStore:
+    """Content-addressed blobs that files are hard-linked to
+
+    Each distinct content is stored once as <directory>/<ab>/<sha256>, and
+    a file with that content is a hard link to the blob, so the name -> hash
+    reference is the link itself and every other reader (the search index,
+    ranged reads, listings) keeps working on plain files. A blob whose only
+    remaining link is its own entry is no longer referenced and is removed.
+    The blob directory must be on the same filesystem as the files.
+    """
+
+    def __init__(self, directory, hashes):
+        self.directory = directory
+        self.hashes = hashes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _blob_path(self, digest):
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def link(self, temp_path, file_path):
+        """Store a finished temporary file as a blob and atomically point file_path at it"""
+        digest = hash_file(temp_path)
+        blob_path = self._blob_path(digest)
+        link_path = temp_path + ".link"
+        with self._lock:
+            try:
+                previous = os.stat(file_path)
+            except FileNotFoundError:
+                previous = None
+            if os.path.exists(blob_path):
+                os.remove(temp_path)
+            else:
+                os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+                os.replace(temp_path, blob_path)
+                _fsync_directory(os.path.dirname(blob_path))
+            blob_stat = os.stat(blob_path)
+            if previous is not None and (previous.st_dev, previous.st_ino) == (blob_stat.st_dev, blob_stat.st_ino):
+                # Same content as before: file_path already links to the blob, and renaming one
+                # link over another of the same file would leave link_path behind
+                return digest
+            os.link(blob_path, link_path)
+            os.replace(link_path, file_path)
+            self.hashes.remember(blob_stat, digest)
+            if previous is not None:
+                self._release(previous)
+        return digest
+
+    def _release(self, stat_result):
+        """Remove the blob a replaced file pointed at if nothing else links to it"""
+        digest = self.hashes.cached(stat_result)
+        if digest is None:
+            return
+        blob_path = self._blob_path(digest)
+        with contextlib.suppress(FileNotFoundError):
+            blob_stat = os.stat(blob_path)
+            if blob_stat.st_ino == stat_result.st_ino and blob_stat.st_nlink == 1:
+                os.remove(blob_path)
+
+    def collect(self):
+        """Remove every blob that no file links to; returns the number removed"""
+        removed = 0
+        with self._lock:
+            for root, _, filenames in os.walk(self.directory):
+                for filename in filenames:
+                    blob_path = os.path.join(root, filename)
+                    if os.stat(blob_path).st_nlink == 1:
+                        os.remove(blob_path)
+                        removed += 1
+        return removed
+
+    def stats(self):
+        blobs = 0
+        size = 0
+        for root, _, filenames in os.walk(self.directory):
+            for filename in filenames:
+                blobs += 1
+                size += os.path.getsize(os.path.join(root, filename))
+        return {"blobs": blobs, "bytes": size}
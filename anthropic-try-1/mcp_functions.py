@@ -0,0 +1,252 @@
+from concurrent.futures import Future
+from datetime import datetime
+import time
+import uuid
+
+JSON_TYPES = {
+    "string": (str,),
+    "integer": (int,),
+    "number": (int, float),
+    "boolean": (bool,),
+    "array": (list,),
+    "object": (dict,),
+    "null": (type(None),),
+}
+
+
+def compile_schema(schema, path="parameters"):
+    """Compile a JSON schema into a validator function
+
+    Supports the subset used by MCP function definitions: type, enum,
+    properties, required, items, minimum, maximum and minLength. The
+    returned function takes a value and returns an error message, or None
+    when the value is valid. Unknown keywords are ignored.
+    """
+    if not isinstance(schema, dict):
+        raise ValueError(f"Schema for {path} must be an object")
+
+    checks = []
+
+    expected_type = schema.get("type")
+    if expected_type is not None:
+        type_names = expected_type if isinstance(expected_type, list) else [expected_type]
+        for type_name in type_names:
+            if type_name not in JSON_TYPES:
+                raise ValueError(f"Unsupported type for {path}: {type_name}")
+        python_types = tuple(t for name in type_names for t in JSON_TYPES[name])
+        # bool is a subclass of int, so it only matches an explicit boolean type
+        allows_bool = "boolean" in type_names
+        type_label = " or ".join(type_names)
+
+        def check_type(value):
+            if not isinstance(value, python_types) or (isinstance(value, bool) and not allows_bool):
+                return f"{path} must be of type {type_label}"
+        checks.append(check_type)
+
+    if "enum" in schema:
+        allowed = list(schema["enum"])
+
+        def check_enum(value):
+            if value not in allowed:
+                return f"{path} must be one of: {', '.join(map(str, allowed))}"
+        checks.append(check_enum)
+
+    if "minimum" in schema or "maximum" in schema:
+        minimum = schema.get("minimum")
+        maximum = schema.get("maximum")
+
+        def check_range(value):
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                return None
+            if minimum is not None and value < minimum:
+                return f"{path} must be at least {minimum}"
+            if maximum is not None and value > maximum:
+                return f"{path} must be at most {maximum}"
+        checks.append(check_range)
+
+    if "minLength" in schema:
+        min_length = schema["minLength"]
+
+        def check_length(value):
+            if isinstance(value, str) and len(value) < min_length:
+                return f"{path} must not be empty" if min_length == 1 else f"{path} is too short"
+        checks.append(check_length)
+
+    properties = {
+        name: compile_schema(property_schema, f"{path}.{name}")
+        for name, property_schema in schema.get("properties", {}).items()
+    }
+    required = list(schema.get("required", []))
+    if properties or required:
+        def check_object(value):
+            if not isinstance(value, dict):
+                return None
+            for name in required:
+                if name not in value:
+                    return f"Missing required parameter: {name}"
+            for name, validate in properties.items():
+                if name in value:
+                    error = validate(value[name])
+                    if error:
+                        return error
+        checks.append(check_object)
+
+    if "items" in schema:
+        validate_item = compile_schema(schema["items"], f"{path}[]")
+
+        def check_items(value):
+            if not isinstance(value, list):
+                return None
+            for item in value:
+                error = validate_item(item)
+                if error:
+                    return error
+        checks.append(check_items)
+
+    def validate(value):
+        for check in checks:
+            error = check(value)
+            if error:
+                return error
+        return None
+
+    return validate
+
+
+class FunctionRegistry:
+    """Registered functions with their handlers and compiled validators
+
+    Behaves like the plain name -> definition dict the servers used before,
+    so listing and lookup code is unchanged, while call() dispatches to the
+    handler with a single dict lookup. Parameter schemas are compiled once
+    at registration rather than checked by hand on every call.
+
+    With a storage backend, definitions are also saved there, and functions
+    registered by another worker process are picked up on first use with
+    default_handler(name) as their handler.
+
+    on_call(name, seconds, success), if given, is called after every call
+    made through function_call_response, e.g. to record latency metrics.
+    """
+
+    def __init__(self, storage=None, default_handler=None, on_call=None):
+        self._entries = {}  # name -> (definition, validator, handler)
+        self._storage = storage
+        self._default_handler = default_handler
+        self._version = 0
+        self.on_call = on_call
+
+    def register(self, name, description, parameters, handler=None):
+        validator = compile_schema(parameters)
+        definition = {
+            "name": name,
+            "description": description,
+            "parameters": parameters
+        }
+        self._entries[name] = (definition, validator, handler)
+        self._version += 1
+        if self._storage is not None:
+            self._storage.save_function(definition)
+        return definition
+
+    @property
+    def version(self):
+        """Changes whenever a function definition is added or replaced"""
+        if self._storage is not None:
+            return (self._version, self._storage.functions_version())
+        return self._version
+
+    def _entry(self, name):
+        entry = self._entries.get(name)
+        if entry is None and self._storage is not None:
+            definition = self._storage.get_function(name)
+            if definition is not None:
+                handler = self._default_handler(name) if self._default_handler else None
+                entry = (definition, compile_schema(definition["parameters"]), handler)
+                self._entries[name] = entry
+        return entry
+
+    def validate(self, name, parameters):
+        """Check parameters against a function's schema, returning an error message or None"""
+        return self._entry(name)[1](parameters)
+
+    def call(self, name, parameters):
+        """Validate parameters and run the function's handler"""
+        definition, validator, handler = self._entry(name)
+        error = validator(parameters)
+        if error:
+            return {"success": False, "error": error}
+        if handler is None:
+            return {"success": False, "error": f"Function implementation not found for {name}"}
+        return handler(parameters)
+
+    def values(self):
+        if self._storage is not None:
+            return self._storage.list_functions()
+        return [entry[0] for entry in self._entries.values()]
+
+    def __getitem__(self, name):
+        entry = self._entry(name)
+        if entry is None:
+            raise KeyError(name)
+        return entry[0]
+
+    def __contains__(self, name):
+        return self._entry(name) is not None
+
+    def __len__(self):
+        return len(self.values())
+
+
+def function_call_response(registry, function_name, parameters):
+    """Run one function call and wrap its result in the function_calls response shape
+
+    Exceptions raised by the handler are turned into an error result, so
+    one failing call never affects the others in a batch.
+    """
+    started = time.perf_counter()
+    try:
+        result = registry.call(function_name, parameters)
+    except Exception as e:
+        result = {"success": False, "error": str(e)}
+    elapsed = time.perf_counter() - started
+    if registry.on_call is not None:
+        success = not isinstance(result, dict) or result.get("success") is not False
+        registry.on_call(function_name, elapsed, success)
+    return {
+        "id": str(uuid.uuid4()),
+        "function": function_name,
+        "result": result,
+        "timestamp": datetime.now().isoformat(),
+        "duration_ms": round(elapsed * 1000, 3)
+    }
+
+
+def run_batch(registry, calls, executor, parallel=True):
+    """Run a list of {"name", "parameters"} calls, returning responses in call order
+
+    With parallel=True the calls are treated as independent and submitted
+    to the executor together; otherwise they run one after another so a
+    later call can depend on an earlier one (e.g. write then read).
+    """
+    pending = []
+    for call in calls:
+        if not isinstance(call, dict) or not isinstance(call.get("name"), str) or "parameters" not in call:
+            pending.append(_call_error(call, "Missing required fields"))
+        elif call["name"] not in registry:
+            pending.append(_call_error(call, f"Function not found: {call['name']}"))
+        elif parallel:
+            pending.append(executor.submit(function_call_response, registry, call["name"], call["parameters"]))
+        else:
+            pending.append(function_call_response(registry, call["name"], call["parameters"]))
+    return [item.result() if isinstance(item, Future) else item for item in pending]
+
+
+def _call_error(call, error):
+    return {
+        "id": str(uuid.uuid4()),
+        "function": call.get("name") if isinstance(call, dict) and isinstance(call.get("name"), str) else None,
+        "result": {"success": False, "error": error},
+        "timestamp": datetime.now().isoformat(),
+        "duration_ms": 0.0
+    }
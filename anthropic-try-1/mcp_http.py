@@ -0,0 +1,176 @@
+from flask import Response, json as flask_json, jsonify, request, stream_with_context
+import base64
+import hashlib
+import json
+import re
+
+MAX_PAGE_SIZE = 1000
+# Unlimited NDJSON listings are read from storage this many records at a time
+STREAM_PAGE_SIZE = 500
+NDJSON_MIMETYPE = "application/x-ndjson"
+# Words with their trailing whitespace, so the deltas concatenate back to the content
+CONTENT_PIECE_PATTERN = re.compile(r"\S+\s*|\s+")
+
+
+def encode_cursor(sort_value, record_id):
+    """Build an opaque cursor pointing just past the given record"""
+    raw = json.dumps([sort_value, record_id]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def decode_cursor(cursor):
+    try:
+        sort_value, record_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except (ValueError, TypeError):
+        raise ValueError(f"Invalid cursor: {cursor}")
+    if not isinstance(sort_value, str) or not isinstance(record_id, str):
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return sort_value, record_id
+
+
+def wants_ndjson():
+    if request.args.get("stream") == "ndjson":
+        return True
+    return request.accept_mimetypes.best == NDJSON_MIMETYPE
+
+
+def ndjson_response(records, headers=None):
+    """Stream records as newline-delimited JSON, one record per line"""
+    def generate():
+        for record in records:
+            yield json.dumps(record) + "\n"
+
+    return Response(stream_with_context(generate()), status=200,
+                    mimetype=NDJSON_MIMETYPE, headers=headers)
+
+
+def fetch_pages(fetch, after=None, sort_key="created_at", page_size=STREAM_PAGE_SIZE):
+    """Yield every record from fetch(limit, after) past after, reading page_size records at a time"""
+    while True:
+        page = fetch(page_size, after)
+        yield from page
+        if len(page) < page_size:
+            return
+        after = (page[-1][sort_key], page[-1]["id"])
+
+
+def list_response(fetch, sort_key="created_at"):
+    """Respond with a list of records, honouring limit/cursor and NDJSON streaming
+
+    fetch(limit, after) returns up to limit records (all of them when limit
+    is None) ordered by sort_key, starting just past the (sort value, id)
+    position after, so the storage backend only reads the requested page.
+    Without a limit or cursor the full list is returned as before; NDJSON
+    without a limit is read and streamed STREAM_PAGE_SIZE records at a time. The
+    cursor for the next page is sent in the X-Next-Cursor header so the
+    JSON body keeps its plain list shape.
+    """
+    limit = request.args.get("limit")
+    if limit is not None:
+        try:
+            limit = int(limit)
+        except ValueError:
+            return jsonify({"error": f"Invalid limit: {limit}"}), 400
+        if limit < 1:
+            return jsonify({"error": "limit must be a positive integer"}), 400
+        limit = min(limit, MAX_PAGE_SIZE)
+
+    cursor = request.args.get("cursor")
+    try:
+        after = decode_cursor(cursor) if cursor else None
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    if limit is None and wants_ndjson():
+        # Stream the whole listing a page at a time, so memory does not grow with its length
+        return ndjson_response(fetch_pages(fetch, after, sort_key))
+
+    # One extra record tells whether there is a next page
+    page = fetch(limit + 1 if limit is not None else None, after)
+    next_cursor = None
+    if limit is not None and len(page) > limit:
+        del page[limit:]
+        next_cursor = encode_cursor(page[-1][sort_key], page[-1]["id"])
+
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else None
+
+    if wants_ndjson():
+        return ndjson_response(page, headers)
+
+    return jsonify(page), 200, headers or {}
+
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def stream_completion(message, on_complete):
+    """Stream an assistant message as Server-Sent Events
+
+    The client gets a message.start event right away, then content.delta
+    events for each piece of content and a tool_call event per tool call.
+    on_complete(message) runs only after everything has been sent, just
+    before the final message.done event carrying the whole message, so a
+    stream the client abandons is never stored.
+    """
+    def generate():
+        yield sse_event("message.start", {
+            "id": message["id"],
+            "conversation_id": message["conversation_id"],
+            "created_at": message["created_at"],
+            "role": message["role"]
+        })
+        content = message["content"]
+        pieces = CONTENT_PIECE_PATTERN.findall(content) if isinstance(content, str) else [content]
+        for piece in pieces:
+            yield sse_event("content.delta", {"id": message["id"], "delta": piece})
+        for tool_call in message.get("tool_calls", []):
+            yield sse_event("tool_call", {"id": message["id"], "tool_call": tool_call})
+        on_complete(message)
+        yield sse_event("message.done", message)
+
+    return Response(stream_with_context(generate()), status=200, mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+class CachedJSONResponse:
+    """A JSON response body that is serialized once per version, served with a strong ETag
+
+    build() produces the payload and version() returns a value that changes
+    whenever the payload would. Until the version changes, requests reuse
+    the serialized body, and a matching If-None-Match gets an empty 304.
+    """
+
+    def __init__(self, build, version):
+        self._build = build
+        self._version = version
+        self._cached = None  # (version, body, etag)
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    def response(self):
+        version = self._version()
+        cached = self._cached
+        if cached is None or cached[0] != version:
+            self.misses += 1
+            body = flask_json.dumps(self._build())
+            etag = hashlib.sha256(body.encode("utf-8")).hexdigest()
+            cached = self._cached = (version, body, etag)
+        else:
+            self.hits += 1
+        _, body, etag = cached
+
+        if request.if_none_match.contains(etag):
+            self.not_modified += 1
+            response = Response(status=304)
+        else:
+            response = Response(body, status=200, mimetype="application/json")
+        response.set_etag(etag)
+        # Clients may keep the body but must revalidate before using it
+        response.headers["Cache-Control"] = "no-cache"
+        return response
+
+    def stats(self):
+        """Serializations reused (hits) or redone (misses), and 304 responses sent"""
+        return {"hits": self.hits, "misses": self.misses, "not_modified": self.not_modified}
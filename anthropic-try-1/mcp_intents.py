@@ -0,0 +1,88 @@
+import re
+import threading
+
+
+def _trie_pattern(keywords):
+    """Build a regex that matches any of the keywords, factored by common prefixes
+
+    Factoring by prefix keeps the work at each text position proportional
+    to the keyword length rather than the number of keywords. Optional
+    suffixes are greedy, so the longest keyword starting at a position wins.
+    """
+    trie = {}
+    for keyword in keywords:
+        node = trie
+        for char in keyword:
+            node = node.setdefault(char, {})
+        node[""] = True
+
+    def emit(node):
+        terminal = "" in node
+        branches = [re.escape(char) + emit(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        if terminal:
+            return "(?:" + body + ")?"
+        return body
+
+    return emit(trie)
+
+
+class IntentRouter:
+    """Maps a message to intents (e.g. candidate tools) with one compiled pattern
+
+    Each intent has a list of trigger phrases. A message matches an intent
+    when any of its phrases occurs in the lowercased message, exactly like
+    any(phrase in message.lower() ...), but all phrases of all intents are
+    checked in a single regex pass instead of one substring scan each.
+    """
+
+    def __init__(self):
+        self._phrases = {}  # phrase -> set of intents
+        self._lock = threading.Lock()
+        self._compiled = None
+
+    def add(self, intent, phrases):
+        with self._lock:
+            for phrase in phrases:
+                phrase = phrase.lower()
+                if phrase:
+                    self._phrases.setdefault(phrase, set()).add(intent)
+            self._compiled = None
+
+    def _compile(self):
+        phrases = sorted(self._phrases)
+        # Only the longest phrase starting at each position is reported, and any
+        # shorter phrase found there is a substring of it, so each phrase also
+        # carries the intents of every phrase it contains.
+        intents = {}
+        for phrase in phrases:
+            implied = set()
+            for other in phrases:
+                if other in phrase:
+                    implied |= self._phrases[other]
+            intents[phrase] = frozenset(implied)
+        pattern = re.compile("(?=(" + _trie_pattern(phrases) + "))") if phrases else None
+        return pattern, intents
+
+    def match(self, message):
+        """Return the set of intents whose phrases occur in the message"""
+        compiled = self._compiled
+        if compiled is None:
+            with self._lock:
+                if self._compiled is None:
+                    self._compiled = self._compile()
+                compiled = self._compiled
+        pattern, intents = compiled
+        if pattern is None:
+            return set()
+
+        matched = set()
+        seen = set()
+        for match in pattern.finditer(message.lower()):
+            phrase = match.group(1)
+            if phrase not in seen:
+                seen.add(phrase)
+                matched |= intents[phrase]
+        return matched
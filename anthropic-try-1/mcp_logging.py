@@ -0,0 +1,195 @@
+from datetime import datetime
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import threading
+
+LOG_QUEUE_SIZE = 10000
+LOG_BATCH_SIZE = 256
+TEXT_FORMAT = logging.BASIC_FORMAT
+
+# Attributes every LogRecord has; anything else was passed through extra= and
+# is written as a field of the JSON record
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line with time, level, logger, message and any extra= fields"""
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "process": record.process,
+            "thread": record.threadName
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRIBUTES and key not in entry:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        if record.stack_info:
+            entry["stack"] = record.stack_info
+        return json.dumps(entry, default=str)
+
+
+class LevelSampler(logging.Filter):
+    """Keep only a fraction of the records at each level, e.g. {logging.INFO: 0.1}
+
+    Levels not listed are always kept, so warnings and errors are never
+    dropped unless asked for.
+    """
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = dict(rates)
+
+    def filter(self, record):
+        rate = self.rates.get(record.levelno)
+        return rate is None or rate >= 1 or random.random() < rate
+
+
+class AsyncLogHandler(logging.Handler):
+    """Handler that queues records for a background thread to format and write in batches
+
+    The calling thread only runs the filters and appends the record to a
+    queue; the message is not even %-formatted until the writer thread gets
+    to it. The writer takes whatever has queued up (up to batch_size
+    records) and writes it to the stream with one write and one flush.
+    When the queue is full, records are dropped and counted rather than
+    blocking the request, and the count is reported in the next batch.
+    """
+
+    def __init__(self, stream=None, max_queue=LOG_QUEUE_SIZE, batch_size=LOG_BATCH_SIZE):
+        super().__init__()
+        self.stream = stream if stream is not None else sys.stderr
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.dropped = 0
+        self._queue = None
+        self._thread = None
+        self._pid = None
+
+    def handle(self, record):
+        # Handler.handle would take the handler lock around emit(); the queue
+        # is already thread safe, so skip it
+        if self.filter(record):
+            self.emit(record)
+            return True
+        return False
+
+    def emit(self, record):
+        # Started lazily in each process, since threads do not survive the fork into a worker
+        if self._pid != os.getpid():
+            self._start()
+        # SimpleQueue has no size limit of its own but never blocks; qsize() is
+        # approximate, which is fine for a bound
+        if self._queue.qsize() >= self.max_queue:
+            self.dropped += 1
+        else:
+            self._queue.put(record)
+
+    def _start(self):
+        with self.lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.SimpleQueue()
+            self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+
+    def _run(self):
+        log_queue = self._queue
+        stopping = False
+        while not stopping:
+            batch = [log_queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(log_queue.get_nowait())
+                except queue.Empty:
+                    break
+            lines = []
+            flushed = []
+            for record in batch:
+                if record is None:
+                    stopping = True
+                elif isinstance(record, threading.Event):
+                    flushed.append(record)
+                else:
+                    try:
+                        lines.append(self.format(record))
+                    except Exception:
+                        self.handleError(record)
+            if self.dropped:
+                dropped, self.dropped = self.dropped, 0
+                lines.append(self.format(logging.makeLogRecord({
+                    "name": __name__, "levelno": logging.WARNING, "levelname": "WARNING",
+                    "msg": "Dropped %d log records because the log queue was full", "args": (dropped,)
+                })))
+            if lines:
+                try:
+                    self.stream.write("\n".join(lines) + "\n")
+                    self.stream.flush()
+                except Exception:
+                    # Nowhere left to report a failed write to the log stream
+                    pass
+            for event in flushed:
+                event.set()
+
+    def flush(self):
+        """Wait until every record queued so far has been written"""
+        if self._pid == os.getpid() and self._thread.is_alive():
+            written = threading.Event()
+            self._queue.put(written)
+            written.wait(timeout=5)
+
+    def close(self):
+        # Called by logging.shutdown() at exit; drain the queue and stop the writer
+        if self._pid == os.getpid() and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout=5)
+        self._pid = None
+        super().close()
+
+
+def parse_sample_rates(value):
+    """Parse "INFO=0.1,DEBUG=0" into {logging.INFO: 0.1, logging.DEBUG: 0.0}"""
+    rates = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        name, separator, rate = item.partition("=")
+        level = logging.getLevelName(name.strip().upper())
+        if not separator or not isinstance(level, int):
+            raise ValueError(f"Invalid log sample rate: {item}")
+        rates[level] = float(rate)
+    return rates
+
+
+def configure_logging(level=logging.INFO):
+    """Set up the root logger from the environment, in place of logging.basicConfig(level=level)
+
+    MCP_LOG_MODE=async (the default) writes from a background thread via
+    AsyncLogHandler; sync writes from the calling thread as before.
+    MCP_LOG_FORMAT=json writes one JSON object per record instead of text.
+    MCP_LOG_SAMPLE="INFO=0.1,DEBUG=0" keeps only that fraction of records
+    at each listed level. MCP_LOG_LEVEL overrides level.
+    """
+    if os.environ.get("MCP_LOG_MODE", "async") == "sync":
+        handler = logging.StreamHandler()
+    else:
+        handler = AsyncLogHandler()
+    if os.environ.get("MCP_LOG_FORMAT", "text") == "json":
+        handler.setFormatter(JSONFormatter())
+    else:
+        handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+    sample = os.environ.get("MCP_LOG_SAMPLE")
+    if sample:
+        handler.addFilter(LevelSampler(parse_sample_rates(sample)))
+    logging.basicConfig(level=os.environ.get("MCP_LOG_LEVEL", level), handlers=[handler])
+    return handler
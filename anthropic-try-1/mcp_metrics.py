@@ -0,0 +1,309 @@
+from bisect import bisect_left
+from collections import Counter as StackCounter
+from contextlib import contextmanager
+import logging
+import os
+import sys
+import threading
+import time
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+        self._values = {}  # label values -> value
+
+    def _labels(self, label_values):
+        return tuple(zip(self.label_names, label_values))
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for label_values, value in items:
+            yield self.name, self._labels(label_values), value
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *label_values, amount=1):
+        self.inc(*label_values, amount=-amount)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, label_names=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, label_names)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *label_values):
+        # Counts are kept per bucket and only made cumulative when rendered
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(label_values)
+            if entry is None:
+                entry = self._values[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def samples(self):
+        with self._lock:
+            items = [(label_values, (list(counts), total, count))
+                     for label_values, (counts, total, count) in self._values.items()]
+        for label_values, (counts, total, count) in items:
+            labels = self._labels(label_values)
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                yield self.name + "_bucket", labels + (("le", _format_value(float(bound))),), cumulative
+            yield self.name + "_sum", labels, total
+            yield self.name + "_count", labels, count
+
+
+class Metrics:
+    """Registry of counters, gauges and histograms rendered in the Prometheus text format
+
+    Recording a value is a dict lookup and an increment under a per-metric
+    lock, cheap enough to leave on in production. Collectors are called at
+    scrape time for values that already live elsewhere (e.g. cache
+    statistics), so they cost nothing between scrapes. Each worker process
+    has its own registry.
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+        self._sections = self.histogram("mcp_section_seconds", "Time spent in instrumented code sections",
+                                        ("section",))
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, label_names=()):
+        return self._register(Counter(name, help_text, label_names))
+
+    def gauge(self, name, help_text, label_names=()):
+        return self._register(Gauge(name, help_text, label_names))
+
+    def histogram(self, name, help_text, label_names=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, help_text, label_names, buckets))
+
+    def add_collector(self, collect):
+        """Register collect() -> iterable of (name, kind, help, labels dict, value), called on every scrape"""
+        self._collectors.append(collect)
+
+    @contextmanager
+    def time(self, section):
+        """Time a block of code into the mcp_section_seconds histogram"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._sections.observe(time.perf_counter() - started, section)
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+
+        # Samples of one metric must be grouped, even when several collectors report it
+        families = {}
+        for collect in self._collectors:
+            try:
+                collected = list(collect())
+            except Exception as e:
+                logging.error("Error collecting metrics: %s", e)
+                continue
+            for name, kind, help_text, labels, value in collected:
+                family = families.setdefault(name, [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"])
+                family.append(f"{name}{_format_labels(sorted(labels.items()))} {_format_value(value)}")
+        for family in families.values():
+            lines.extend(family)
+        return "\n".join(lines) + "\n"
+
+
+def observe_function_calls(metrics):
+    """Return an on_call hook for FunctionRegistry that records per-function latency"""
+    calls = metrics.histogram("mcp_function_call_seconds", "Function call latency", ("function", "outcome"))
+
+    def on_call(name, seconds, success):
+        calls.observe(seconds, name, "success" if success else "error")
+
+    return on_call
+
+
+def cache_collector(name, stats):
+    """Collector exposing hits, misses and hit ratio of a cache whose stats() has hits and misses"""
+    def collect():
+        values = stats()
+        labels = {"cache": name}
+        lookups = values["hits"] + values["misses"]
+        yield "mcp_cache_hits_total", "counter", "Cache hits", labels, values["hits"]
+        yield "mcp_cache_misses_total", "counter", "Cache misses", labels, values["misses"]
+        yield "mcp_cache_hit_ratio", "gauge", "Cache hits divided by lookups", labels, \
+            values["hits"] / lookups if lookups else 0.0
+
+    return collect
+
+
+class SlowRequestProfiler:
+    """Sampling profiler for requests that run longer than a threshold
+
+    A background thread wakes every interval seconds and, for each request
+    that has been running longer than threshold seconds, records the stack
+    of the thread serving it. Fast requests are never sampled, so the cost
+    is one dict scan per interval. When a sampled request finishes, its
+    stacks are logged in collapsed ("folded") form, most frequent first,
+    and also written to output_directory when one is given, ready for
+    flamegraph tools.
+    """
+
+    def __init__(self, threshold, interval=0.01, output_directory=None, top_stacks=5):
+        self.threshold = threshold
+        self.interval = interval
+        self.output_directory = output_directory
+        self.top_stacks = top_stacks
+        self._lock = threading.Lock()
+        self._active = {}  # thread id -> [started, samples]
+        self._pid = None
+        if output_directory:
+            os.makedirs(output_directory, exist_ok=True)
+
+    def begin(self):
+        # Started lazily in each process, since threads do not survive the fork into a worker
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name="slow-request-profiler", daemon=True).start()
+        with self._lock:
+            self._active[threading.get_ident()] = [time.perf_counter(), StackCounter()]
+
+    def end(self, route, elapsed):
+        with self._lock:
+            entry = self._active.pop(threading.get_ident(), None)
+        if entry is None or not entry[1]:
+            return
+        samples = entry[1]
+        logging.warning("Slow request %s took %.0f ms; %d samples, top stacks:\n%s", route, elapsed * 1000,
+                        sum(samples.values()),
+                        "\n".join(f"{count} {stack}" for stack, count in samples.most_common(self.top_stacks)))
+        if self.output_directory:
+            filename = f"slow-{int(time.time() * 1000)}-{threading.get_ident()}.folded"
+            with open(os.path.join(self.output_directory, filename), "w", encoding="utf-8") as file:
+                file.write(f"# {route} {elapsed * 1000:.0f} ms\n")
+                for stack, count in samples.most_common():
+                    file.write(f"{stack} {count}\n")
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            now = time.perf_counter()
+            with self._lock:
+                slow = [(thread_id, entry[1]) for thread_id, entry in self._active.items()
+                        if now - entry[0] > self.threshold]
+            if not slow:
+                continue
+            frames = sys._current_frames()
+            for thread_id, samples in slow:
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    samples[_collapse(frame)] += 1
+
+
+def _collapse(frame):
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+        frame = frame.f_back
+    return ";".join(reversed(stack))
+
+
+def instrument_app(app, metrics, profiler=None):
+    """Record latency, bytes, status and in-flight requests for every route of a Flask app
+
+    Requests are labelled by route pattern (e.g. /api/mcp/v1/conversations/<conversation_id>)
+    rather than path, so label cardinality stays bounded. Streamed responses
+    are timed until the stream finishes.
+    """
+    from flask import g, request
+
+    requests_total = metrics.counter("mcp_http_requests_total", "HTTP requests", ("route", "method", "status"))
+    latency = metrics.histogram("mcp_http_request_seconds", "HTTP request latency", ("route", "method"))
+    in_flight = metrics.gauge("mcp_http_requests_in_flight", "HTTP requests being served")
+    request_bytes = metrics.counter("mcp_http_request_bytes_total", "HTTP request body bytes", ("route",))
+    response_bytes = metrics.counter("mcp_http_response_bytes_total",
+                                     "HTTP response body bytes, excluding streamed responses", ("route",))
+
+    def route():
+        return request.url_rule.rule if request.url_rule is not None else "unmatched"
+
+    @app.before_request
+    def start_timer():
+        g.metrics_started = time.perf_counter()
+        in_flight.inc()
+        if profiler is not None:
+            profiler.begin()
+
+    @app.after_request
+    def record_response(response):
+        g.metrics_status = response.status_code
+        if not response.is_streamed:
+            response_bytes.inc(route(), amount=response.calculate_content_length() or 0)
+        return response
+
+    @app.teardown_request
+    def stop_timer(exception):
+        started = g.pop("metrics_started", None)
+        if started is None:
+            return
+        elapsed = time.perf_counter() - started
+        name = route()
+        latency.observe(elapsed, name, request.method)
+        requests_total.inc(name, request.method, str(g.pop("metrics_status", 500)))
+        request_bytes.inc(name, amount=request.content_length or 0)
+        in_flight.dec()
+        if profiler is not None:
+            profiler.end(name, elapsed)
+
+
+def metrics_response(metrics):
+    from flask import Response
+    return Response(metrics.render(), status=200, content_type=PROMETHEUS_CONTENT_TYPE)
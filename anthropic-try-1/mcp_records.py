@@ -0,0 +1,107 @@
+from datetime import datetime
+import sys
+
+MESSAGE_FIELDS = ("id", "conversation_id", "created_at", "role", "content", "metadata")
+
+# Shared by every record without metadata; to_dict() hands out a fresh {} in its place
+EMPTY_METADATA = {}
+
+
+def timestamp_to_micros(value):
+    """Convert a naive ISO timestamp from datetime.now().isoformat() to integer epoch microseconds
+
+    Anything else (a timezone-aware or malformed value) is returned as is,
+    so it still serializes back unchanged.
+    """
+    if not isinstance(value, str):
+        return value
+    try:
+        moment = datetime.fromisoformat(value)
+    except ValueError:
+        return value
+    if moment.tzinfo is not None:
+        return value
+    # Whole seconds convert exactly; adding microseconds separately avoids float rounding
+    micros = int(moment.replace(microsecond=0).timestamp()) * 1_000_000 + moment.microsecond
+    return micros if micros_to_timestamp(micros) == value else value
+
+
+def micros_to_timestamp(value):
+    if not isinstance(value, int):
+        return value
+    seconds, micros = divmod(value, 1_000_000)
+    return datetime.fromtimestamp(seconds).replace(microsecond=micros).isoformat()
+
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+def _compact_metadata(metadata):
+    return EMPTY_METADATA if type(metadata) is dict and not metadata else metadata
+
+
+def _expand_metadata(metadata):
+    return {} if metadata is EMPTY_METADATA else metadata
+
+
+class ConversationRecord:
+    """Compact in-memory form of a conversation dict"""
+
+    __slots__ = ("id", "created_at", "updated_at", "title", "metadata")
+
+    def __init__(self, conversation):
+        self.id = conversation["id"]
+        self.created_at = timestamp_to_micros(conversation["created_at"])
+        self.updated_at = timestamp_to_micros(conversation["updated_at"])
+        self.title = _intern(conversation["title"])
+        self.metadata = _compact_metadata(conversation["metadata"])
+
+    def touch(self, updated_at):
+        self.updated_at = timestamp_to_micros(updated_at)
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "created_at": micros_to_timestamp(self.created_at),
+            "updated_at": micros_to_timestamp(self.updated_at),
+            "title": self.title,
+            "metadata": _expand_metadata(self.metadata)
+        }
+
+
+class MessageRecord:
+    """Compact in-memory form of a message dict
+
+    Timestamps are integer epoch microseconds, roles are interned, empty
+    metadata is one shared object and the conversation id is shared with
+    the conversation's own record. Keys beyond the fixed fields (e.g.
+    tool_calls) are kept in extra. to_dict() rebuilds the original shape.
+    """
+
+    __slots__ = ("id", "conversation_id", "created_at", "role", "content", "metadata", "extra")
+
+    def __init__(self, message, conversation_id=None):
+        self.id = message["id"]
+        self.conversation_id = conversation_id or message["conversation_id"]
+        self.created_at = timestamp_to_micros(message["created_at"])
+        self.role = _intern(message["role"])
+        self.content = message["content"]
+        self.metadata = _compact_metadata(message["metadata"])
+        extra = None
+        if len(message) > len(MESSAGE_FIELDS):
+            extra = {key: value for key, value in message.items() if key not in MESSAGE_FIELDS}
+        self.extra = extra
+
+    def to_dict(self):
+        message = {
+            "id": self.id,
+            "conversation_id": self.conversation_id,
+            "created_at": micros_to_timestamp(self.created_at),
+            "role": self.role,
+            "content": self.content,
+            "metadata": _expand_metadata(self.metadata)
+        }
+        if self.extra:
+            message.update(self.extra)
+        return message
@@ -0,0 +1,227 @@
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+import functools
+import logging
+import os
+import re
+import threading
+import time
+
+from mcp_file_io import walk_files
+
+try:
+    from re import _parser as regex_parser
+except ImportError:  # Python < 3.11
+    import sre_parse as regex_parser
+
+# Atomic groups and possessive repeats (Python 3.11+) never backtrack into their contents
+_BACKTRACKING_REPEATS = {regex_parser.MAX_REPEAT, regex_parser.MIN_REPEAT}
+_NO_BACKTRACKING = {getattr(regex_parser, name) for name in ("ATOMIC_GROUP", "POSSESSIVE_REPEAT")
+                    if hasattr(regex_parser, name)}
+
+MAX_LOCATIONS_PER_FILE = 50
+FILES_PER_TASK = 64
+# How often the deadline is checked while matching within one file
+MATCHES_PER_DEADLINE_CHECK = 1024
+# Searches stop after this many seconds even without a timeout of their own
+MAX_SEARCH_SECONDS = 60
+# How long timed out tasks get to notice the deadline before their workers are killed
+CANCEL_GRACE_SECONDS = 1.0
+
+
+def compile_query(query, regex=False, whole_word=False, case_sensitive=False):
+    """Turn search options into a regex source and flags; raises re.error for bad patterns"""
+    source = query if regex else re.escape(query)
+    if whole_word:
+        source = rf"\b(?:{source})\b"
+    flags = 0 if case_sensitive else re.IGNORECASE
+    re.compile(source, flags)
+    if regex and _has_nested_repeat(regex_parser.parse(source, flags)):
+        raise re.error("nested repeats such as (a+)+ can take exponential time to match; "
+                       "use an atomic group (?>...) or a possessive quantifier such as a++ instead")
+    return source, flags
+
+
+def _has_nested_repeat(pattern, repeated=False):
+    """True if a variable repeat is nested in an unbounded one, the usual cause of catastrophic backtracking"""
+    for op, value in pattern:
+        if op in _BACKTRACKING_REPEATS:
+            low, high, item = value
+            if repeated and high > max(low, 1):
+                return True
+            if _has_nested_repeat(item, repeated or high == regex_parser.MAXREPEAT):
+                return True
+        elif op not in _NO_BACKTRACKING:
+            if any(_has_nested_repeat(item, repeated) for item in _subpatterns(value)):
+                return True
+    return False
+
+
+def _subpatterns(value):
+    if isinstance(value, regex_parser.SubPattern):
+        yield value
+    elif isinstance(value, (tuple, list)):
+        for item in value:
+            yield from _subpatterns(item)
+
+
+@functools.lru_cache(maxsize=64)
+def _compiled(source, flags):
+    return re.compile(source, flags)
+
+
+def _search_files(directory, filenames, source, flags, deadline):
+    """Worker: search a batch of files, returning results for the files that match
+
+    Once the deadline (a time.time() value) passes, the current file stops
+    at its next check and the rest are skipped, so a timed out search does
+    not keep the workers busy.
+    """
+    pattern = _compiled(source, flags)
+    results = []
+    for filename in filenames:
+        if deadline is not None and time.time() > deadline:
+            break
+        try:
+            with open(os.path.join(directory, filename), 'r', encoding='utf-8') as file:
+                content = file.read()
+        except (OSError, UnicodeDecodeError):
+            continue
+
+        matches = 0
+        locations = []
+        line = 1
+        line_start = 0
+        scanned = 0
+        for match in pattern.finditer(content):
+            matches += 1
+            if deadline is not None and not matches % MATCHES_PER_DEADLINE_CHECK and time.time() > deadline:
+                break
+            if len(locations) < MAX_LOCATIONS_PER_FILE:
+                # Count newlines incrementally instead of rescanning from the start
+                start = match.start()
+                newlines = content.count("\n", scanned, start)
+                if newlines:
+                    line += newlines
+                    line_start = content.rfind("\n", scanned, start) + 1
+                scanned = start
+                locations.append({"line": line, "column": start - line_start + 1})
+        if matches:
+            results.append({"filename": filename, "matches": matches, "locations": locations})
+    return results
+
+
+class ParallelSearcher:
+    """Searches a directory and its subdirectories by reading files across a pool of processes
+
+    Used for queries the inverted index cannot answer (regular expressions,
+    whole words, case-sensitive matches) and for directories that are not
+    indexed. Files are handed out in batches, results are yielded as each
+    batch finishes, and the search stops early once max_results files have
+    matched or the timeout (at most max_timeout seconds) expires. A worker
+    still busy shortly after the timeout is stuck inside a single match,
+    which cannot be interrupted, so the pool is replaced and its workers
+    killed; other searches rerun their unfinished batches on the new pool.
+    """
+
+    def __init__(self, directory, processes=None, max_timeout=MAX_SEARCH_SECONDS):
+        self.directory = directory
+        self.processes = processes or os.cpu_count()
+        self.max_timeout = max_timeout
+        self._lock = threading.RLock()
+        self._pool = None
+
+    def start(self):
+        """Create the worker processes
+
+        Call this before starting background threads: worker processes are
+        forked on POSIX, and forking while other threads hold locks is unsafe.
+        """
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.processes)
+                for future in [self._pool.submit(os.getpid) for _ in range(self.processes)]:
+                    future.result()
+            return self._pool
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+
+    def _recycle(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is None:
+            return
+        logging.warning("Search timed out with workers still matching; replacing the search process pool")
+        # ProcessPoolExecutor has no public way to stop a running task
+        for process in list((pool._processes or {}).values()):
+            process.terminate()
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def _submit(self, pending, filenames, source, flags, deadline, resubmitted=False):
+        # Submitted under the lock so the pool cannot be shut down in between
+        with self._lock:
+            future = self.start().submit(_search_files, self.directory, filenames, source, flags, deadline)
+        pending[future] = (filenames, resubmitted)
+
+    def search(self, source, flags, max_results=None, timeout=None):
+        """Yield per-file results as they are found, then a final summary dict
+
+        The summary has "done": True along with files_searched, timed_out and
+        truncated, so streaming clients can tell how the search ended.
+        """
+        if self.max_timeout:
+            timeout = min(timeout or self.max_timeout, self.max_timeout)
+        deadline = time.time() + timeout if timeout else None
+        # Same file set and names as the search index, subdirectories included
+        filenames = sorted(filename for filename, _ in walk_files(self.directory))
+
+        pending = {}  # future -> (filenames, resubmitted)
+        for i in range(0, len(filenames), FILES_PER_TASK):
+            self._submit(pending, filenames[i:i + FILES_PER_TASK], source, flags, deadline)
+        found = 0
+        timed_out = False
+        truncated = False
+        try:
+            while pending:
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        timed_out = True
+                        break
+                done, _ = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+                for future in done:
+                    batch, resubmitted = pending.pop(future)
+                    try:
+                        results = future.result()
+                    except BrokenProcessPool:
+                        if resubmitted:
+                            raise
+                        # Another search replaced the pool; run this batch again on the new one
+                        self._submit(pending, batch, source, flags, deadline, resubmitted=True)
+                        continue
+                    for result in results:
+                        if max_results is not None and found >= max_results:
+                            truncated = True
+                            break
+                        found += 1
+                        yield result
+                    if truncated:
+                        break
+                if truncated:
+                    break
+        finally:
+            running = [future for future in pending if not future.cancel()]
+            if timed_out and running and wait(running, timeout=CANCEL_GRACE_SECONDS).not_done:
+                self._recycle()
+
+        yield {
+            "done": True,
+            "files_searched": len(filenames),
+            "timed_out": timed_out,
+            "truncated": truncated
+        }
@@ -0,0 +1,79 @@
+import argparse
+import logging
+import multiprocessing
+import os
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run an MCP server")
+    parser.add_argument("--production", action="store_true",
+                        help="Serve with gunicorn worker processes instead of the Flask debug server")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--workers", type=int, default=multiprocessing.cpu_count(),
+                        help="Number of worker processes (production only)")
+    parser.add_argument("--threads", type=int, default=16,
+                        help="Request threads per worker process (production only)")
+    parser.add_argument("--timeout", type=int, default=120,
+                        help="Seconds a request may run before its worker is restarted (production only)")
+    parser.add_argument("--graceful-timeout", type=int, default=30,
+                        help="Seconds to let in-flight requests finish on shutdown (production only)")
+    return parser.parse_args(argv)
+
+
+def run(app, on_worker_start=None, on_worker_exit=None, argv=None):
+    """Run a Flask MCP server in development or production mode
+
+    Without --production this is the same Flask debug server as before. With
+    --production the app is served by gunicorn with several worker processes,
+    each running a pool of request threads, so a slow search_files or
+    read_file blocks only its own thread. SIGTERM drains in-flight requests
+    for up to --graceful-timeout seconds before workers exit.
+
+    on_worker_start and on_worker_exit run in every process that serves
+    requests, which is where background threads have to be started since
+    threads do not survive the fork into a worker.
+    """
+    args = parse_args(argv)
+
+    if not args.production:
+        # The debug reloader keeps a watcher process that only restarts the server; only the
+        # child it starts (marked by WERKZEUG_RUN_MAIN) serves requests
+        if on_worker_start and os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+            on_worker_start()
+        app.run(debug=True, host=args.host, port=args.port)
+        return
+
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        raise SystemExit("Production mode requires gunicorn: pip install gunicorn")
+
+    options = {
+        "bind": f"{args.host}:{args.port}",
+        "workers": args.workers,
+        "worker_class": "gthread",
+        "threads": args.threads,
+        "timeout": args.timeout,
+        "graceful_timeout": args.graceful_timeout,
+    }
+    if on_worker_start:
+        options["post_worker_init"] = lambda worker: on_worker_start()
+    if on_worker_exit:
+        options["worker_exit"] = lambda server, worker: on_worker_exit()
+
+    class MCPApplication(BaseApplication):
+        def load_config(self):
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return app
+
+    storage_url = os.environ.get("MCP_STORAGE", "memory")
+    if args.workers > 1 and storage_url.startswith("journal://"):
+        raise SystemExit("Journal storage belongs to a single process; use --workers 1 or sqlite storage")
+    if args.workers > 1 and storage_url.split("?")[0] == "memory":
+        logging.warning("Each worker process keeps its own in-memory state; set MCP_STORAGE to share it")
+    logging.info("Serving on %s with %s workers x %s threads", options["bind"], args.workers, args.threads)
+    MCPApplication().run()
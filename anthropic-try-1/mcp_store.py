@@ -0,0 +1,965 @@
+import atexit
+import itertools
+import json
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from operator import attrgetter
+from urllib.parse import parse_qs
+
+from mcp_records import ConversationRecord, MessageRecord, timestamp_to_micros
+
+
+class MessageStore:
+    """In-memory message storage indexed by conversation
+
+    Messages are kept both by id and as an ordered list per conversation,
+    so fetching a conversation's history only touches that conversation.
+    Entries are MessageRecord objects.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_id = {}
+        self._by_conversation = {}
+
+    def add(self, message):
+        """Store a message and append it to its conversation's history"""
+        with self._lock:
+            self._insert(message)
+        return message
+
+    def add_many(self, new_messages):
+        """Store several messages under a single lock acquisition"""
+        with self._lock:
+            for message in new_messages:
+                self._insert(message)
+        return new_messages
+
+    def _insert(self, message):
+        self._by_id[message.id] = message
+        self._by_conversation.setdefault(message.conversation_id, []).append(message)
+
+    def pop_conversation(self, conversation_id):
+        """Remove and return all messages of a conversation"""
+        with self._lock:
+            removed = self._by_conversation.pop(conversation_id, [])
+            for message in removed:
+                self._by_id.pop(message.id, None)
+        return removed
+
+    def get(self, message_id, default=None):
+        return self._by_id.get(message_id, default)
+
+    def list(self, conversation_id, limit=None, after=None):
+        """Return the messages of a conversation in insertion order, optionally one page of them"""
+        with self._lock:
+            return _page(self._by_conversation.get(conversation_id, []), "created_at", limit, after)
+
+    def values(self):
+        return self._by_id.values()
+
+    def __getitem__(self, message_id):
+        return self._by_id[message_id]
+
+    def __contains__(self, message_id):
+        return message_id in self._by_id
+
+    def __len__(self):
+        return len(self._by_id)
+
+
+def _timestamp_order(value):
+    """Sort key for a stored timestamp that compares the integer micros without formatting them
+
+    Values that did not convert to micros (timezone-aware or malformed
+    timestamps) sort after all the others.
+    """
+    return (0, value) if isinstance(value, int) else (1, str(value))
+
+
+def _sort_by_timestamp(records, sort_key):
+    """Sort records in place in _timestamp_order of sort_key"""
+    try:
+        # Timestamps are normally all integer micros, which compare fastest as they are
+        records.sort(key=attrgetter(sort_key))
+    except TypeError:
+        records.sort(key=lambda record: _timestamp_order(getattr(record, sort_key)))
+
+
+def _page(records, sort_key, limit=None, after=None):
+    """Return up to limit records following the cursor position after
+
+    records must be ordered by _timestamp_order of sort_key. after is a
+    (sort value, id) pair; records sharing its sort value are resumed just
+    past the record with that id, or all included if it is gone. Only the
+    page is copied.
+    """
+    start = 0
+    if after is not None:
+        sort_value, record_id = after
+        sort_value = _timestamp_order(timestamp_to_micros(sort_value))
+        # Binary search for the first record at or after the cursor's sort value
+        low, high = 0, len(records)
+        while low < high:
+            middle = (low + high) // 2
+            if _timestamp_order(getattr(records[middle], sort_key)) < sort_value:
+                low = middle + 1
+            else:
+                high = middle
+        start = low
+        for index in range(low, len(records)):
+            if _timestamp_order(getattr(records[index], sort_key)) != sort_value:
+                break
+            if records[index].id == record_id:
+                start = index + 1
+                break
+    return records[start:] if limit is None else records[start:start + limit]
+
+
+class _UpdatedOrder:
+    """Conversation records kept in updated_at order, so a page is found without sorting
+
+    Entries are (timestamp order, creation sequence, record) in a sorted
+    list; touching a conversation moves its one entry, and conversations
+    with equal updated_at stay in creation order.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = []
+        self._by_id = {}  # conversation id -> its entry
+        self._sequence = itertools.count()
+
+    def add(self, record, updated_at=None):
+        """Insert a record, or move it after touching it with updated_at"""
+        with self._lock:
+            entry = self._by_id.get(record.id)
+            if entry is not None:
+                del self._entries[bisect_left(self._entries, entry)]
+            if updated_at is not None:
+                record.touch(updated_at)
+            sequence = entry[1] if entry is not None else next(self._sequence)
+            entry = self._by_id[record.id] = (_timestamp_order(record.updated_at), sequence, record)
+            insort(self._entries, entry)
+
+    def remove(self, conversation_id):
+        with self._lock:
+            entry = self._by_id.pop(conversation_id, None)
+            if entry is not None:
+                del self._entries[bisect_left(self._entries, entry)]
+
+    def page(self, limit=None, after=None):
+        """Return up to limit records past the (updated_at, id) cursor after, like _page"""
+        with self._lock:
+            start = 0
+            if after is not None:
+                sort_value, record_id = after
+                sort_value = _timestamp_order(timestamp_to_micros(sort_value))
+                start = bisect_left(self._entries, (sort_value,))
+                for index in range(start, len(self._entries)):
+                    entry = self._entries[index]
+                    if entry[0] != sort_value:
+                        break
+                    if entry[2].id == record_id:
+                        start = index + 1
+                        break
+            entries = self._entries[start:] if limit is None else self._entries[start:start + limit]
+        return [entry[2] for entry in entries]
+
+
+class MemoryStorage:
+    """Storage backend keeping conversations, messages and functions in process memory
+
+    Fast, but state is lost on restart and not shared between worker processes.
+    Conversations and messages are kept as compact records and only turned
+    back into dicts when they are read.
+    """
+
+    def __init__(self):
+        self._conversations = {}
+        self._updated_order = _UpdatedOrder()
+        self._messages = MessageStore()
+        self._functions = {}
+        self._functions_version = 0
+
+    # Conversations
+
+    def create_conversation(self, conversation):
+        record = ConversationRecord(conversation)
+        self._conversations[record.id] = record
+        self._updated_order.add(record)
+        return conversation
+
+    def get_conversation(self, conversation_id):
+        record = self._conversations.get(conversation_id)
+        return record.to_dict() if record is not None else None
+
+    def list_conversations(self, order_by="created_at", limit=None, after=None):
+        # Conversations are stored in creation order and indexed by updated_at
+        if order_by == "updated_at":
+            records = self._updated_order.page(limit, after)
+        else:
+            records = _page(list(self._conversations.values()), order_by, limit, after)
+        return [record.to_dict() for record in records]
+
+    def touch_conversation(self, conversation_id, updated_at):
+        record = self._conversations.get(conversation_id)
+        if record is not None:
+            self._updated_order.add(record, updated_at)
+
+    # Messages
+
+    def _record(self, message):
+        # Messages share the id string held by their conversation's record
+        conversation = self._conversations.get(message["conversation_id"])
+        return MessageRecord(message, conversation.id if conversation is not None else None)
+
+    def add_message(self, message):
+        self._messages.add(self._record(message))
+        return message
+
+    def add_messages(self, new_messages):
+        self._messages.add_many([self._record(message) for message in new_messages])
+        return new_messages
+
+    def get_message(self, message_id):
+        record = self._messages.get(message_id)
+        return record.to_dict() if record is not None else None
+
+    def list_messages(self, conversation_id, limit=None, after=None):
+        return [record.to_dict() for record in self._messages.list(conversation_id, limit, after)]
+
+    # Functions
+
+    def save_function(self, definition):
+        self._functions[definition["name"]] = definition
+        self._functions_version += 1
+
+    def get_function(self, name):
+        return self._functions.get(name)
+
+    def functions_version(self):
+        return self._functions_version
+
+    def list_functions(self):
+        return list(self._functions.values())
+
+    def stats(self):
+        return {
+            "backend": type(self).__name__,
+            "conversations": len(self._conversations),
+            "messages": len(self._messages)
+        }
+
+
+# Rough per-message cost of a MessageRecord and its index entries, excluding content
+MESSAGE_OVERHEAD_BYTES = 300
+
+
+def _message_bytes(message):
+    content = message["content"]
+    return MESSAGE_OVERHEAD_BYTES + (sys.getsizeof(content) if isinstance(content, str) else len(json.dumps(content)))
+
+
+class BoundedMemoryStorage(MemoryStorage):
+    """MemoryStorage with a cap on conversations and memory, evicting idle conversations
+
+    Conversations are tracked in least-recently-used order. Once there are
+    more than max_conversations, or their messages take more than roughly
+    max_bytes, the least recently used conversation is evicted together with
+    all of its messages; conversations idle for longer than idle_ttl
+    seconds are evicted as well. Memory use is an estimate based on message
+    content size.
+
+    Without a spill backend evicted conversations are gone. With one (e.g.
+    SQLiteStorage) they are written there first and loaded back into memory
+    the next time they are accessed; listings include spilled conversations
+    without loading them.
+    """
+
+    def __init__(self, max_conversations=None, max_bytes=None, idle_ttl=None, spill=None):
+        super().__init__()
+        self.max_conversations = max_conversations
+        self.max_bytes = max_bytes
+        self.idle_ttl = idle_ttl
+        self.spill = spill
+        self._lock = threading.RLock()
+        self._usage = OrderedDict()  # conversation_id -> [last_access, bytes], least recent first
+        self._bytes = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.spills = 0
+        self.reloads = 0
+
+    def _access(self, conversation_id, added_bytes=0):
+        usage = self._usage.get(conversation_id)
+        if usage is None:
+            usage = self._usage[conversation_id] = [0, 0]
+        else:
+            self._usage.move_to_end(conversation_id)
+        usage[0] = time.monotonic()
+        usage[1] += added_bytes
+        self._bytes += added_bytes
+
+    def _ensure_loaded(self, conversation_id):
+        """Bring a spilled conversation back into memory; returns False if it is unknown"""
+        if conversation_id in self._usage:
+            return True
+        if self.spill is None:
+            return False
+        conversation = self.spill.get_conversation(conversation_id)
+        if conversation is None:
+            return False
+        messages = self.spill.list_messages(conversation_id)
+        super().create_conversation(conversation)
+        super().add_messages(messages)
+        self._access(conversation_id, sum(_message_bytes(message) for message in messages))
+        self.spill.delete_conversation(conversation_id)
+        self.reloads += 1
+        self._evict(keep=conversation_id)
+        return True
+
+    def _evict(self, keep=None):
+        """Evict expired conversations, then least recently used ones while over a limit"""
+        now = time.monotonic()
+        while self._usage:
+            conversation_id, (last_access, _) = next(iter(self._usage.items()))
+            if conversation_id == keep:
+                break
+            if self.idle_ttl is not None and now - last_access > self.idle_ttl:
+                self.expirations += 1
+            elif (self.max_conversations is not None and len(self._usage) > self.max_conversations) or \
+                    (self.max_bytes is not None and self._bytes > self.max_bytes):
+                self.evictions += 1
+            else:
+                break
+            self._drop(conversation_id)
+
+    def _drop(self, conversation_id):
+        _, size = self._usage.pop(conversation_id)
+        self._bytes -= size
+        record = self._conversations.pop(conversation_id, None)
+        self._updated_order.remove(conversation_id)
+        messages = self._messages.pop_conversation(conversation_id)
+        if self.spill is not None and record is not None:
+            self.spill.create_conversation(record.to_dict())
+            self.spill.add_messages([message.to_dict() for message in messages])
+            self.spills += 1
+
+    # Conversations
+
+    def create_conversation(self, conversation):
+        with self._lock:
+            super().create_conversation(conversation)
+            self._access(conversation["id"])
+            self._evict(keep=conversation["id"])
+        return conversation
+
+    def get_conversation(self, conversation_id):
+        with self._lock:
+            if not self._ensure_loaded(conversation_id):
+                return None
+            self._access(conversation_id)
+            self._evict(keep=conversation_id)
+            return super().get_conversation(conversation_id)
+
+    def list_conversations(self, order_by="created_at", limit=None, after=None):
+        with self._lock:
+            self._evict()
+            if self.spill is None:
+                return super().list_conversations(order_by, limit, after)
+
+            # Reloaded conversations are appended out of order; memory is bounded, so sorting it is cheap
+            def sort_value(record):
+                return _timestamp_order(getattr(record, order_by))
+
+            records = list(self._conversations.values())
+            _sort_by_timestamp(records, order_by)
+            records = _page(records, order_by, None, after)
+            if after is not None and after[1] not in self._conversations:
+                # Memory comes before the spill on ties, so a cursor in the spill is past all of them
+                cursor_value = _timestamp_order(timestamp_to_micros(after[0]))
+                records = [record for record in records if sort_value(record) != cursor_value]
+            conversation_list = [record.to_dict() for record in records[:limit]]
+        # Each side returns at most one page past the cursor, so the merged page is complete
+        conversation_list += self.spill.list_conversations(order_by, limit, after)
+        conversation_list.sort(key=lambda conversation: conversation[order_by])
+        return conversation_list[:limit]
+
+    def touch_conversation(self, conversation_id, updated_at):
+        with self._lock:
+            if self._ensure_loaded(conversation_id):
+                super().touch_conversation(conversation_id, updated_at)
+                self._access(conversation_id)
+
+    # Messages
+
+    def add_message(self, message):
+        return self.add_messages([message])[0]
+
+    def add_messages(self, new_messages):
+        with self._lock:
+            for message in new_messages:
+                self._ensure_loaded(message["conversation_id"])
+            super().add_messages(new_messages)
+            for message in new_messages:
+                self._access(message["conversation_id"], _message_bytes(message))
+            self._evict(keep=new_messages[-1]["conversation_id"] if new_messages else None)
+        return new_messages
+
+    def get_message(self, message_id):
+        message = super().get_message(message_id)
+        if message is None and self.spill is not None:
+            message = self.spill.get_message(message_id)
+        return message
+
+    def list_messages(self, conversation_id, limit=None, after=None):
+        with self._lock:
+            if self._ensure_loaded(conversation_id):
+                self._access(conversation_id)
+            return super().list_messages(conversation_id, limit, after)
+
+    def stats(self):
+        with self._lock:
+            stats = super().stats()
+            stats.update({
+                "estimated_bytes": self._bytes,
+                "max_conversations": self.max_conversations,
+                "max_bytes": self.max_bytes,
+                "idle_ttl": self.idle_ttl,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "spills": self.spills,
+                "reloads": self.reloads
+            })
+        if self.spill is not None:
+            stats["spilled_conversations"] = self.spill.stats()["conversations"]
+        return stats
+
+
+MESSAGE_COLUMNS = ("id", "conversation_id", "created_at", "role", "content", "metadata")
+
+
+class SQLiteStorage:
+    """Storage backend in an SQLite database in WAL mode
+
+    Several worker processes can share one database file, and state
+    survives restarts without any replay. Each thread (and each forked
+    process) opens its own connection.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS conversations (
+            id TEXT PRIMARY KEY,
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL,
+            title TEXT NOT NULL,
+            metadata TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_conversations_created_at ON conversations (created_at);
+        CREATE INDEX IF NOT EXISTS idx_conversations_updated_at ON conversations (updated_at);
+
+        CREATE TABLE IF NOT EXISTS messages (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            id TEXT NOT NULL UNIQUE,
+            conversation_id TEXT NOT NULL,
+            created_at TEXT NOT NULL,
+            role TEXT NOT NULL,
+            content TEXT NOT NULL,
+            metadata TEXT NOT NULL,
+            extra TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_messages_conversation ON messages (conversation_id, created_at, seq);
+        CREATE INDEX IF NOT EXISTS idx_messages_created_at ON messages (created_at);
+
+        CREATE TABLE IF NOT EXISTS functions (
+            name TEXT PRIMARY KEY,
+            definition TEXT NOT NULL
+        );
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._connection().executescript(self.SCHEMA)
+
+    def _connection(self):
+        local = self._local
+        if getattr(local, "pid", None) != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            local.connection = connection
+            local.pid = os.getpid()
+        return local.connection
+
+    # Conversations
+
+    def create_conversation(self, conversation):
+        self._connection().execute(
+            "INSERT INTO conversations (id, created_at, updated_at, title, metadata) VALUES (?, ?, ?, ?, ?)",
+            (conversation["id"], conversation["created_at"], conversation["updated_at"],
+             conversation["title"], json.dumps(conversation["metadata"]))
+        )
+        return conversation
+
+    def get_conversation(self, conversation_id):
+        row = self._connection().execute(
+            "SELECT * FROM conversations WHERE id = ?", (conversation_id,)
+        ).fetchone()
+        return _conversation_from_row(row) if row else None
+
+    def list_conversations(self, order_by="created_at", limit=None, after=None):
+        if order_by not in ("created_at", "updated_at"):
+            raise ValueError(f"Invalid order_by: {order_by}")
+        query = "SELECT * FROM conversations"
+        parameters = []
+        if after is not None:
+            # A cursor whose conversation is gone resumes at the first one with its sort value
+            query += (f" WHERE ({order_by}, rowid) > "
+                      "(?, COALESCE((SELECT rowid FROM conversations WHERE id = ?), -1))")
+            parameters += after
+        query += f" ORDER BY {order_by}, rowid"
+        if limit is not None:
+            query += " LIMIT ?"
+            parameters.append(limit)
+        rows = self._connection().execute(query, parameters)
+        return [_conversation_from_row(row) for row in rows]
+
+    def touch_conversation(self, conversation_id, updated_at):
+        self._connection().execute(
+            "UPDATE conversations SET updated_at = ? WHERE id = ?", (updated_at, conversation_id)
+        )
+
+    # Messages
+
+    def add_message(self, message):
+        self._connection().execute(self._INSERT_MESSAGE, _message_to_row(message))
+        return message
+
+    def add_messages(self, new_messages):
+        connection = self._connection()
+        with connection:
+            connection.execute("BEGIN")
+            connection.executemany(self._INSERT_MESSAGE, [_message_to_row(message) for message in new_messages])
+        return new_messages
+
+    _INSERT_MESSAGE = (
+        "INSERT INTO messages (id, conversation_id, created_at, role, content, metadata, extra) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?)"
+    )
+
+    def get_message(self, message_id):
+        row = self._connection().execute("SELECT * FROM messages WHERE id = ?", (message_id,)).fetchone()
+        return _message_from_row(row) if row else None
+
+    def list_messages(self, conversation_id, limit=None, after=None):
+        query = "SELECT * FROM messages WHERE conversation_id = ?"
+        parameters = [conversation_id]
+        if after is not None:
+            query += " AND (created_at, seq) > (?, COALESCE((SELECT seq FROM messages WHERE id = ?), -1))"
+            parameters += after
+        query += " ORDER BY created_at, seq"
+        if limit is not None:
+            query += " LIMIT ?"
+            parameters.append(limit)
+        rows = self._connection().execute(query, parameters)
+        return [_message_from_row(row) for row in rows]
+
+    # Functions
+
+    def save_function(self, definition):
+        self._connection().execute(
+            "INSERT OR REPLACE INTO functions (name, definition) VALUES (?, ?)",
+            (definition["name"], json.dumps(definition))
+        )
+
+    def get_function(self, name):
+        row = self._connection().execute("SELECT definition FROM functions WHERE name = ?", (name,)).fetchone()
+        return json.loads(row["definition"]) if row else None
+
+    def list_functions(self):
+        rows = self._connection().execute("SELECT definition FROM functions ORDER BY rowid")
+        return [json.loads(row["definition"]) for row in rows]
+
+    def functions_version(self):
+        # INSERT OR REPLACE gives the row a new rowid, so this changes on every save
+        row = self._connection().execute("SELECT COUNT(*), MAX(rowid) FROM functions").fetchone()
+        return tuple(row)
+
+    def delete_conversation(self, conversation_id):
+        """Delete a conversation and all of its messages"""
+        connection = self._connection()
+        with connection:
+            connection.execute("BEGIN")
+            connection.execute("DELETE FROM messages WHERE conversation_id = ?", (conversation_id,))
+            connection.execute("DELETE FROM conversations WHERE id = ?", (conversation_id,))
+
+    def stats(self):
+        connection = self._connection()
+        return {
+            "backend": type(self).__name__,
+            "conversations": connection.execute("SELECT COUNT(*) FROM conversations").fetchone()[0],
+            "messages": connection.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+        }
+
+
+def _conversation_from_row(row):
+    return {
+        "id": row["id"],
+        "created_at": row["created_at"],
+        "updated_at": row["updated_at"],
+        "title": row["title"],
+        "metadata": json.loads(row["metadata"])
+    }
+
+
+def _message_to_row(message):
+    # Keys beyond the fixed columns (e.g. tool_calls) are kept in a JSON column
+    extra = {key: value for key, value in message.items() if key not in MESSAGE_COLUMNS}
+    return (
+        message["id"], message["conversation_id"], message["created_at"], message["role"],
+        json.dumps(message["content"]), json.dumps(message["metadata"]),
+        json.dumps(extra) if extra else None
+    )
+
+
+def _message_from_row(row):
+    message = {
+        "id": row["id"],
+        "conversation_id": row["conversation_id"],
+        "created_at": row["created_at"],
+        "role": row["role"],
+        "content": json.loads(row["content"]),
+        "metadata": json.loads(row["metadata"])
+    }
+    if row["extra"]:
+        message.update(json.loads(row["extra"]))
+    return message
+
+
+class WriteAheadLog:
+    """Append-only log of JSON records with group commit
+
+    append() only queues a record; a writer thread writes everything queued
+    so far with a single write and fsync, so concurrent writers share the
+    cost of each fsync. wait() blocks until a record is durable.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "ab")
+        self._condition = threading.Condition()
+        self._pending = []
+        self._appended = 0
+        self._durable = 0
+        self._closed = False
+        self._writer = threading.Thread(target=self._run, name="wal-writer", daemon=True)
+        self._writer.start()
+
+    def append(self, record):
+        """Queue a record and return a ticket to pass to wait()"""
+        line = (json.dumps(record, separators=(",", ":")) + "\n").encode("utf-8")
+        with self._condition:
+            if self._closed:
+                raise ValueError(f"Write-ahead log {self.path} is closed")
+            self._pending.append(line)
+            self._appended += 1
+            self._condition.notify_all()
+            return self._appended
+
+    def wait(self, ticket):
+        with self._condition:
+            while self._durable < ticket:
+                self._condition.wait()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending and not self._closed:
+                    self._condition.wait()
+                if not self._pending:
+                    return
+                batch, self._pending = self._pending, []
+                ticket = self._appended
+            self._file.write(b"".join(batch))
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            with self._condition:
+                self._durable = ticket
+                self._condition.notify_all()
+
+    def close(self):
+        """Flush everything queued so far and close the file"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._writer.join()
+        self._file.close()
+
+
+def _read_log(path):
+    """Yield the records of a log file, ignoring a torn final line from a crash"""
+    with open(path, "rb") as file:
+        for line in file:
+            if not line.endswith(b"\n"):
+                logging.warning("Ignoring incomplete record at the end of %s", path)
+                return
+            yield json.loads(line)
+
+
+class JournaledMemoryStorage(MemoryStorage):
+    """In-memory storage made durable with a write-ahead log and snapshots
+
+    Reads are served from memory exactly like MemoryStorage. Every mutation
+    is also appended to a log segment (wal.<n>.log) and the caller waits for
+    the group commit that makes it durable. Periodically the state is written
+    to a compacted snapshot (snapshot.<n>.json) covering every segment up to
+    n, after which those segments are deleted. Startup loads the newest
+    snapshot and replays only the segments written after it.
+
+    The directory must belong to a single server process. Recovery and the
+    log writer and snapshot threads start on first use in each process
+    rather than when the storage is created: threads do not survive the
+    fork into a worker, and a worker restarted by gunicorn has to see what
+    its predecessor wrote, not the state the master had at import.
+    """
+
+    def __init__(self, directory, snapshot_interval=300):
+        super().__init__()
+        self.directory = directory
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        self.snapshot_interval = snapshot_interval
+        self._open_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._pid = None
+        self._log = None
+        self._stop = threading.Event()
+        atexit.register(self.close)
+
+    def _open(self):
+        if self._pid == os.getpid():
+            return
+        with self._open_lock:
+            if self._pid == os.getpid():
+                return
+            # Discard whatever was inherited from the parent; the log on disk is authoritative
+            MemoryStorage.__init__(self)
+            self._lock = threading.Lock()
+            self._segment = self._recover()
+            self._changes = 0
+            self._log = WriteAheadLog(self._segment_path(self._segment))
+            self._stop = threading.Event()
+            threading.Thread(target=self._snapshot_loop, args=(self.snapshot_interval, self._stop),
+                             name="wal-snapshot", daemon=True).start()
+            self._pid = os.getpid()
+
+    def _segment_path(self, number):
+        return os.path.join(self.directory, f"wal.{number}.log")
+
+    def _snapshot_path(self, number):
+        return os.path.join(self.directory, f"snapshot.{number}.json")
+
+    def _numbered(self, prefix, suffix):
+        numbers = []
+        for filename in os.listdir(self.directory):
+            if filename.startswith(prefix) and filename.endswith(suffix):
+                number = filename[len(prefix):-len(suffix)]
+                if number.isdigit():
+                    numbers.append(int(number))
+        return sorted(numbers)
+
+    # Recovery
+
+    def _recover(self):
+        """Load the latest snapshot, replay newer log segments and return the next segment number"""
+        snapshots = self._numbered("snapshot.", ".json")
+        covered = 0
+        if snapshots:
+            covered = snapshots[-1]
+            with open(self._snapshot_path(covered), "r", encoding="utf-8") as file:
+                state = json.load(file)
+            for conversation in state["conversations"]:
+                super().create_conversation(conversation)
+            super().add_messages(state["messages"])
+            for definition in state["functions"]:
+                super().save_function(definition)
+
+        segments = [number for number in self._numbered("wal.", ".log") if number > covered]
+        replayed = 0
+        for number in segments:
+            for record in _read_log(self._segment_path(number)):
+                self._apply(record)
+                replayed += 1
+        if snapshots or segments:
+            logging.info("Recovered storage from snapshot %s and %s log records", covered, replayed)
+        return max(segments + [covered]) + 1
+
+    def _apply(self, record):
+        op = record["op"]
+        if op == "conversation":
+            super().create_conversation(record["conversation"])
+        elif op == "touch":
+            super().touch_conversation(record["id"], record["updated_at"])
+        elif op == "messages":
+            super().add_messages(record["messages"])
+        elif op == "function":
+            super().save_function(record["definition"])
+
+    # Reads
+
+    def get_conversation(self, conversation_id):
+        self._open()
+        return super().get_conversation(conversation_id)
+
+    def list_conversations(self, order_by="created_at", limit=None, after=None):
+        self._open()
+        return super().list_conversations(order_by, limit, after)
+
+    def get_message(self, message_id):
+        self._open()
+        return super().get_message(message_id)
+
+    def list_messages(self, conversation_id, limit=None, after=None):
+        self._open()
+        return super().list_messages(conversation_id, limit, after)
+
+    def get_function(self, name):
+        self._open()
+        return super().get_function(name)
+
+    def functions_version(self):
+        self._open()
+        return super().functions_version()
+
+    def list_functions(self):
+        self._open()
+        return super().list_functions()
+
+    def stats(self):
+        self._open()
+        return super().stats()
+
+    # Mutations
+
+    def _journal(self, record):
+        self._open()
+        # Applying and queueing under one lock keeps memory and log in the same order
+        with self._lock:
+            self._apply(record)
+            # snapshot() may swap in a new log once the lock is released; the ticket belongs to this one
+            log = self._log
+            ticket = log.append(record)
+            self._changes += 1
+        log.wait(ticket)
+
+    def create_conversation(self, conversation):
+        self._journal({"op": "conversation", "conversation": conversation})
+        return conversation
+
+    def touch_conversation(self, conversation_id, updated_at):
+        self._journal({"op": "touch", "id": conversation_id, "updated_at": updated_at})
+
+    def add_message(self, message):
+        self._journal({"op": "messages", "messages": [message]})
+        return message
+
+    def add_messages(self, new_messages):
+        self._journal({"op": "messages", "messages": list(new_messages)})
+        return new_messages
+
+    def save_function(self, definition):
+        self._journal({"op": "function", "definition": definition})
+
+    # Snapshots
+
+    def snapshot(self):
+        """Write a compacted snapshot and drop the log segments it covers"""
+        self._open()
+        with self._lock:
+            if not self._changes:
+                return
+            # Switch to a new segment; the snapshot covers everything before it
+            covered = self._segment
+            self._log.close()
+            self._segment += 1
+            self._log = WriteAheadLog(self._segment_path(self._segment))
+            self._changes = 0
+            conversations = [record.to_dict() for record in self._conversations.values()]
+            message_records = list(self._messages.values())
+            functions = list(self._functions.values())
+        # Message records are never modified, so they can be serialized outside the lock
+        state = {
+            "conversations": conversations,
+            "messages": [record.to_dict() for record in message_records],
+            "functions": functions
+        }
+
+        temp_path = self._snapshot_path(covered) + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as file:
+            json.dump(state, file, separators=(",", ":"))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, self._snapshot_path(covered))
+
+        for number in self._numbered("wal.", ".log"):
+            if number <= covered:
+                os.remove(self._segment_path(number))
+        for number in self._numbered("snapshot.", ".json"):
+            if number < covered:
+                os.remove(self._snapshot_path(number))
+        logging.info("Wrote storage snapshot %s", covered)
+
+    def _snapshot_loop(self, interval, stop):
+        while not stop.wait(interval):
+            try:
+                self.snapshot()
+            except Exception as e:
+                logging.error("Error writing storage snapshot: %s", e)
+
+    def close(self):
+        if self._pid != os.getpid() or self._stop.is_set():
+            return
+        self._stop.set()
+        with self._lock:
+            self._log.close()
+
+
+def open_storage(url):
+    """Create a storage backend from a URL
+
+    "memory", "journal:///path/to/directory" (memory plus write-ahead log)
+    or "sqlite:///path/to/file.db". As in SQLAlchemy URLs, the path after
+    the three slashes is relative to the working directory, and an absolute
+    path adds a fourth: "sqlite:////var/lib/mcp/mcp.db".
+
+    "memory" takes optional limits, e.g.
+    "memory?max_conversations=10000&max_mb=512&idle_ttl=3600&spill=/path/to/spill.db",
+    to evict idle conversations, optionally spilling them to an SQLite file.
+    """
+    if url == "memory":
+        return MemoryStorage()
+    if url.startswith("memory?"):
+        options = {key: values[-1] for key, values in parse_qs(url[len("memory?"):], strict_parsing=True).items()}
+        unknown = set(options) - {"max_conversations", "max_mb", "idle_ttl", "spill"}
+        if unknown:
+            raise ValueError(f"Unsupported memory storage options: {', '.join(sorted(unknown))}")
+        return BoundedMemoryStorage(
+            max_conversations=int(options["max_conversations"]) if "max_conversations" in options else None,
+            max_bytes=int(float(options["max_mb"]) * 1024 * 1024) if "max_mb" in options else None,
+            idle_ttl=float(options["idle_ttl"]) if "idle_ttl" in options else None,
+            spill=SQLiteStorage(options["spill"]) if "spill" in options else None
+        )
+    if url.startswith("journal:///"):
+        return JournaledMemoryStorage(url[len("journal:///"):])
+    if url.startswith("sqlite:///"):
+        return SQLiteStorage(url[len("sqlite:///"):])
+    raise ValueError(f"Unsupported storage URL: {url}")
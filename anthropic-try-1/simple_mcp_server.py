@@ -2,43 +2,68 @@ from flask import Flask, request, jsonify
 import uuid
 import json
 import logging
+import os
 from datetime import datetime
 
+from mcp_http import list_response, stream_completion
+from mcp_logging import configure_logging
+from mcp_metrics import Metrics, SlowRequestProfiler, instrument_app, metrics_response
+from mcp_serve import run
+from mcp_store import open_storage
+
 app = Flask(__name__)
-logging.basicConfig(level=logging.INFO)
+configure_logging()
+
+# Prometheus-style metrics served at /metrics. Set MCP_PROFILE_SLOW_MS to also
+# sample the stacks of requests slower than that and log them
+metrics = Metrics()
+SLOW_REQUEST_MS = os.environ.get("MCP_PROFILE_SLOW_MS")
+slow_request_profiler = SlowRequestProfiler(float(SLOW_REQUEST_MS) / 1000) if SLOW_REQUEST_MS else None
+instrument_app(app, metrics, slow_request_profiler)
 
-# In-memory storage for conversations and messages
-conversations = {}
-messages = {}
+# Storage for conversations and messages: "memory" (default),
+# "journal:///mcp-journal" to keep it in memory but log every change to disk,
+# "sqlite:///mcp.db" to persist state and share it between worker processes, or
+# "memory?max_conversations=10000&idle_ttl=3600&spill=/path/to/spill.db" caps memory by
+# evicting idle conversations. Paths after "///" are relative; absolute paths take
+# a fourth slash, e.g. "sqlite:////var/lib/mcp/mcp.db" (see open_storage for all options)
+STORAGE_URL = os.environ.get("MCP_STORAGE", "memory")
+storage = open_storage(STORAGE_URL)
 
 @app.route("/api/mcp/v1/conversations", methods=["POST"])
 def create_conversation():
     conversation_id = str(uuid.uuid4())
-    conversations[conversation_id] = {
+    now = datetime.now().isoformat()
+    conversation = storage.create_conversation({
         "id": conversation_id,
-        "created_at": datetime.now().isoformat(),
-        "updated_at": datetime.now().isoformat(),
+        "created_at": now,
+        "updated_at": now,
         "title": "New Conversation",
         "metadata": {}
-    }
+    })
     
-    logging.info(f"Created conversation: {conversation_id}")
-    return jsonify(conversations[conversation_id]), 201
+    logging.info("Created conversation: %s", conversation_id)
+    return jsonify(conversation), 201
 
 @app.route("/api/mcp/v1/conversations", methods=["GET"])
 def list_conversations():
-    return jsonify(list(conversations.values())), 200
+    order_by = request.args.get("order_by", "created_at")
+    if order_by not in ("created_at", "updated_at"):
+        return jsonify({"error": f"Invalid order_by: {order_by}"}), 400
+    
+    return list_response(lambda limit, after: storage.list_conversations(order_by, limit, after), sort_key=order_by)
 
 @app.route("/api/mcp/v1/conversations/<conversation_id>", methods=["GET"])
 def get_conversation(conversation_id):
-    if conversation_id not in conversations:
+    conversation = storage.get_conversation(conversation_id)
+    if conversation is None:
         return jsonify({"error": "Conversation not found"}), 404
     
-    return jsonify(conversations[conversation_id]), 200
+    return jsonify(conversation), 200
 
 @app.route("/api/mcp/v1/conversations/<conversation_id>/messages", methods=["POST"])
 def create_message(conversation_id):
-    if conversation_id not in conversations:
+    if storage.get_conversation(conversation_id) is None:
         return jsonify({"error": "Conversation not found"}), 404
     
     data = request.get_json()
@@ -48,29 +73,28 @@ def create_message(conversation_id):
         return jsonify({"error": "Missing required fields"}), 400
     
     message_id = str(uuid.uuid4())
-    messages[message_id] = {
+    message = storage.add_message({
         "id": message_id,
         "conversation_id": conversation_id,
         "created_at": datetime.now().isoformat(),
         "role": data["role"],
         "content": data["content"],
         "metadata": data.get("metadata", {})
-    }
+    })
     
     # Update conversation
-    conversations[conversation_id]["updated_at"] = datetime.now().isoformat()
+    storage.touch_conversation(conversation_id, message["created_at"])
     
-    logging.info(f"Created message: {message_id} in conversation: {conversation_id}")
-    return jsonify(messages[message_id]), 201
+    logging.info("Created message: %s in conversation: %s", message_id, conversation_id)
+    return jsonify(message), 201
 
 @app.route("/api/mcp/v1/conversations/<conversation_id>/messages", methods=["GET"])
 def list_messages(conversation_id):
-    if conversation_id not in conversations:
+    if storage.get_conversation(conversation_id) is None:
         return jsonify({"error": "Conversation not found"}), 404
     
-    # Filter messages by conversation_id
-    conversation_messages = [msg for msg in messages.values() if msg["conversation_id"] == conversation_id]
-    return jsonify(conversation_messages), 200
+    # Messages are indexed by conversation, so only the requested page of its history is read
+    return list_response(lambda limit, after: storage.list_messages(conversation_id, limit, after))
 
 @app.route("/api/mcp/v1/completions", methods=["POST"])
 def create_completion():
@@ -81,7 +105,7 @@ def create_completion():
         return jsonify({"error": "Missing required fields"}), 400
     
     conversation_id = data["conversation_id"]
-    if conversation_id not in conversations:
+    if storage.get_conversation(conversation_id) is None:
         return jsonify({"error": "Conversation not found"}), 404
     
     # Here you would normally process the messages and generate a response
@@ -97,14 +121,31 @@ def create_completion():
         "metadata": {}
     }
     
+    if data.get("stream") is True:
+        # Stream the reply as SSE; it is stored only once the whole message has been sent
+        return stream_completion(response_message, store_completion)
+    
+    store_completion(response_message)
+    return jsonify(response_message), 201
+
+def store_completion(message):
     # Store the message
-    messages[message_id] = response_message
+    storage.add_message(message)
     
     # Update conversation
-    conversations[conversation_id]["updated_at"] = datetime.now().isoformat()
+    storage.touch_conversation(message["conversation_id"], message["created_at"])
     
-    logging.info(f"Created completion message: {message_id} in conversation: {conversation_id}")
-    return jsonify(response_message), 201
+    logging.info("Created completion message: %s in conversation: %s", message["id"], message["conversation_id"])
+
+@app.route("/api/mcp/v1/system/storage", methods=["GET"])
+def get_storage_stats():
+    # Conversation and message counts, plus eviction counters for bounded memory storage
+    return jsonify(storage.stats()), 200
+
+@app.route("/metrics", methods=["GET"])
+def get_metrics():
+    return metrics_response(metrics)
 
 if __name__ == "__main__":
-    app.run(debug=True, host="0.0.0.0", port=5000)
\ No newline at end of file
+    # Pass --production to serve with gunicorn worker processes
+    run(app)
\ No newline at end of file